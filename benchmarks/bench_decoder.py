@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Micro-benchmark for the notification decoder.
+
+Feeds a synthetic stream of 7- and 10-byte weight packets through
+NotificationDecoder and reports the decode rate in packets per second.
+
+    PYTHONPATH=. python benchmarks/bench_decoder.py
+"""
+
+import timeit
+from types import SimpleNamespace
+
+from pydecentscale.decoder import NotificationDecoder
+from pydecentscale.replay import make_packet
+
+
+def synthetic_stream(n=1000):
+    """Weight packets ramping from 0 to n/10 grams, alternating 7 and 10 bytes"""
+    packets = []
+    for i in range(n):
+        raw = i.to_bytes(2, 'big', signed=True)
+        if i % 2:
+            packets.append(make_packet(0xCE, raw + bytes([0, i // 10 % 60, i % 10, 0, 0])))
+        else:
+            packets.append(make_packet(0xCE, raw + bytes([0, 0])))
+    return packets
+
+
+def main(repeat=5, number=200):
+    scale = SimpleNamespace(weight=None, sample=None, weight_unit='g',
+                            battery_level=None, firmware_version=None)
+    decode = NotificationDecoder(scale)
+    packets = synthetic_stream()
+
+    def run():
+        for p in packets:
+            decode(None, p)
+
+    best = min(timeit.repeat(run, repeat=repeat, number=number))
+    pps = len(packets) * number / best
+    print('NotificationDecoder: %.0f packets/s (%.2f us/packet)' % (pps, 1e6 / pps))
+
+
+if __name__ == '__main__':
+    main()
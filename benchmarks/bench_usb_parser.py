@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Throughput benchmark for the USB serial frame parser.
+
+Splits synthetic byte streams (7- or 10-byte weight packets with some line
+noise, or text-protocol weight lines) into reads of a given size and feeds
+them to FrameParser, next to the buffer-slicing parser of
+examples/usb_connection/read_from_usb.py. Large reads model bursts after
+the reader thread was delayed. 32-byte reads are the CH340's USB packet
+size.
+
+Each figure is the best of several runs, so the packet caches are warm, as
+they are on a scale repeating the same weights. The 20000 text lines all
+differ, so the first run, with cold caches, is the worst case: there the
+two text parsers are about as fast.
+
+    PYTHONPATH=. python benchmarks/bench_usb_parser.py
+"""
+
+import functools
+import operator
+import random
+import time
+
+from pydecentscale.replay import make_packet
+from pydecentscale.transport import weight_packet
+from pydecentscale.usb import FrameParser
+
+
+def synthetic_bytes(n=20000, ten_byte=False, noise=0.01, seed=0):
+    """n weight packets as one byte string, with a stray byte pair every 1/noise packets"""
+    rng = random.Random(seed)
+    stream = bytearray()
+    for i in range(n):
+        raw = (i % 30000).to_bytes(2, 'big')
+        if ten_byte:
+            stream += make_packet(0xCE, raw + bytes([i // 600 % 256, i // 10 % 60, i % 10, 0, 0]))
+        else:
+            stream += make_packet(0xCE, raw + bytes([0, 0]))
+        if rng.random() < noise:
+            stream += bytes([0x03, rng.randrange(256)])
+    return bytes(stream)
+
+
+def synthetic_text(n=20000):
+    """n text-protocol weight lines as one byte string"""
+    return b''.join(b'Weight: %.1f\r\n' % (i % 30000 / 10) for i in range(n))
+
+
+def legacy_parse_text(data_buffer):
+    """Text mode of DecentScaleUSB._extract_weight, without prints. Weights are
+    turned into packets like FrameParser does, so both do the same work."""
+    frames = 0
+    lines = data_buffer.decode('ascii', errors='ignore').split('\n')
+    for line in lines[:-1]:
+        if "Weight:" in line:
+            try:
+                weight_packet(float(line.split("Weight:")[1].strip()))
+                frames += 1
+            except (IndexError, ValueError):
+                pass
+    return bytearray(lines[-1], 'ascii'), frames
+
+
+def legacy_parse(data_buffer):
+    """Binary mode of DecentScaleUSB._extract_weight (7-byte packets), without prints"""
+    frames = 0
+    while len(data_buffer) >= 7:
+        start_index = data_buffer.find(0x03)
+        if start_index == -1:
+            break
+        if len(data_buffer) < start_index + 7:
+            break
+        packet = data_buffer[start_index:start_index + 7]
+        if functools.reduce(operator.xor, packet[:-1]) == packet[-1]:
+            frames += 1
+            data_buffer = data_buffer[start_index + 7:]
+        else:
+            data_buffer.pop(start_index)
+    return data_buffer, frames
+
+
+def chunks(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def bench_frame_parser(reads):
+    parser = FrameParser()
+    frames = 0
+    start = time.perf_counter()
+    for read in reads:
+        frames += len(parser.feed(read))
+    return frames, time.perf_counter() - start
+
+
+def bench_legacy(reads, parse=legacy_parse):
+    buffer = bytearray()
+    frames = 0
+    start = time.perf_counter()
+    for read in reads:
+        buffer.extend(read)
+        buffer, n = parse(buffer)
+        frames += n
+    return frames, time.perf_counter() - start
+
+
+def best(bench, *args, repeat=5):
+    """Best of ``repeat`` runs. Every run after the first finds the weight
+    packets cached, whichever parser ran first."""
+    return min((bench(*args) for _ in range(repeat)), key=lambda result: result[1])
+
+
+def main():
+    for ten_byte in (False, True):
+        data = synthetic_bytes(ten_byte=ten_byte)
+        for size in (32, 4096, 65536):
+            reads = chunks(data, size)
+            frames, elapsed = best(bench_frame_parser, reads)
+            line = '%2d-byte packets, %5d-byte reads: FrameParser %8.0f packets/s, %6.1f MB/s' % (
+                10 if ten_byte else 7, size, frames / elapsed, len(data) / elapsed / 1e6)
+            if not ten_byte:
+                legacy_frames, legacy_elapsed = best(bench_legacy, reads)
+                line += ' | legacy %8.0f packets/s' % (legacy_frames / legacy_elapsed)
+            print(line)
+
+    data = synthetic_text()
+    for size in (32, 4096, 65536):
+        reads = chunks(data, size)
+        frames, elapsed = best(bench_frame_parser, reads)
+        legacy_frames, legacy_elapsed = best(bench_legacy, reads, legacy_parse_text)
+        print('  text lines, %5d-byte reads: FrameParser %8.0f lines/s,   %6.1f MB/s | legacy %8.0f lines/s' % (
+            size, frames / elapsed, len(data) / elapsed / 1e6, legacy_frames / legacy_elapsed))
+
+
+if __name__ == '__main__':
+    main()
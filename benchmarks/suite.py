@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Benchmark suite with saved baselines.
+
+Runs every hot path on synthetic data, without hardware:
+
+- ``decoder``: NotificationDecoder on 7- and 10-byte weight packets
+- ``notification_e2e``: packets delivered by a fake BLE client to a
+  connected AsyncDecentScale (decoder, flow rate and sample update)
+- ``tare_command`` / ``calculate_xor``: building a tare command and its
+  checksum
+- ``usb_frame_parser`` / ``usb_legacy_parser``: FrameParser and the buffer
+  slicing _extract_weight of the USB example, on 4 KiB reads
+- ``wifi_parse``: a JSON snapshot to a weight packet, as WebSocketTransport
+  does it (orjson when installed)
+- ``command_rtt``: tare() round trip against a fake client that
+  acknowledges on the next loop iteration
+
+Each benchmark reports a rate (``packets_per_second`` or
+``calls_per_second``; ``command_rtt`` reports ``p50_us`` and ``p99_us``)
+and, from tracemalloc, ``allocated_bytes_per_packet``: the peak memory
+allocated while one item (packet, call or USB read) is handled, above what
+was in use before it, summed over all items and divided by the packets.
+Temporary objects freed before the next packet count too, so per-packet
+garbage shows up even when nothing is retained.
+
+    PYTHONPATH=. python benchmarks/suite.py --save baseline.json
+    ... change something ...
+    PYTHONPATH=. python benchmarks/suite.py --compare baseline.json
+
+With ``--compare``, metrics that got worse by more than ``--tolerance``
+(10% by default) are reported and the exit status is 1. Rates are the best
+of several repeats, so rerun on a quiet machine before trusting a
+regression.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import timeit
+import tracemalloc
+
+from bench_decoder import synthetic_stream
+from bench_usb_parser import bench_legacy, chunks, legacy_parse, synthetic_bytes
+
+from pydecentscale.async_scale import AsyncDecentScale
+from pydecentscale.replay import FakeBleakClient, make_packet
+from pydecentscale.transport import weight_packet
+from pydecentscale.usb import FrameParser
+from pydecentscale.wifi import parse_grams
+
+# Metrics where a smaller value is better; every other metric is a rate
+LOWER_IS_BETTER = ('p50_us', 'p99_us', 'allocated_bytes_per_packet')
+
+# Allocation changes smaller than these are noise (caches, free lists)
+ALLOCATION_FLOOR = {'allocated_bytes_per_packet': 8.0}
+
+
+def rate(run, count, repeat, number=1):
+    """Best rate of ``count * number`` items per second over ``repeat`` runs"""
+    best = min(timeit.repeat(run, repeat=repeat, number=number))
+    return count * number / best
+
+
+def _noop(item):
+    pass
+
+
+# More than CPython keeps on the free lists of dicts, dict keys, lists and floats
+FREE_LIST_SIZE = 200
+
+
+def _take_free_lists():
+    """Objects that empty the free lists while they are alive. Objects taken
+    from a free list are not allocated, so tracemalloc would not see the
+    small dicts and lists a packet leaves behind."""
+    return ([{'': None} for _ in range(FREE_LIST_SIZE)],
+            [[None] for _ in range(FREE_LIST_SIZE)],
+            [i + 0.5 for i in range(FREE_LIST_SIZE)])
+
+
+def _allocated(step, items):
+    """Sum over ``items`` of the peak traced memory above the start of ``step(item)``"""
+    reset_peak = tracemalloc.reset_peak
+    traced = tracemalloc.get_traced_memory
+    total = 0
+    for item in items:
+        taken = _take_free_lists()
+        reset_peak()
+        start = traced()[0]
+        step(item)
+        total += traced()[1] - start
+        del taken
+    return total
+
+
+def allocations(step, items, count):
+    """Bytes allocated per packet by ``step(item)`` over ``items``, which hold
+    ``count`` packets in total"""
+    for item in items:
+        step(item)  # warm caches so only the steady state is measured
+    tracemalloc.start()
+    try:
+        # The measuring loop allocates too (the tuple holding start)
+        overhead = _allocated(_noop, items)
+        allocated = _allocated(step, items)
+    finally:
+        tracemalloc.stop()
+    return {'allocated_bytes_per_packet': max(allocated - overhead, 0) / count}
+
+
+def measure(run, count, repeat, step, items, unit='packets_per_second'):
+    """Rate of ``run()`` and allocations of ``step(item)`` for each of ``items``"""
+    result = {unit: rate(run, count, repeat)}
+    result.update(allocations(step, items, count))
+    return result
+
+
+def bench_decoder(n, repeat):
+    scale = AsyncDecentScale()
+    decode = scale.notification_handler
+    packets = synthetic_stream(n)
+
+    def run():
+        for p in packets:
+            decode(None, p)
+
+    return measure(run, len(packets), repeat, lambda p: decode(None, p), packets)
+
+
+def bench_tare_command(n, repeat):
+    scale = AsyncDecentScale()
+    generate = scale.generate_tare_command
+
+    def run():
+        for _ in range(n):
+            generate()
+
+    return measure(run, n, repeat, lambda _: generate(), range(n), 'calls_per_second')
+
+
+def bench_calculate_xor(n, repeat):
+    scale = AsyncDecentScale()
+    calculate_xor = scale.calculate_xor
+    cmd = make_packet(0x0F, (1, 0, 0, 0))
+
+    def run():
+        for _ in range(n):
+            calculate_xor(cmd)
+
+    return measure(run, n, repeat, lambda _: calculate_xor(cmd), range(n), 'calls_per_second')
+
+
+def bench_usb_frame_parser(n, repeat):
+    reads = chunks(synthetic_bytes(n), 4096)
+
+    def run():
+        parser = FrameParser()
+        for read in reads:
+            parser.feed(read)
+
+    return measure(run, n, repeat, FrameParser().feed, reads)
+
+
+def bench_usb_legacy_parser(n, repeat):
+    reads = chunks(synthetic_bytes(n), 4096)
+
+    def run():
+        bench_legacy(reads)
+
+    buffer = bytearray()
+
+    def step(read):
+        nonlocal buffer
+        buffer.extend(read)
+        buffer, _ = legacy_parse(buffer)
+
+    return measure(run, n, repeat, step, reads)
+
+
+def bench_wifi_parse(n, repeat):
+    messages = ['{"grams": %.1f, "ms": %d}' % (i % 3000 / 10, i * 100) for i in range(n)]
+
+    def run():
+        for message in messages:
+            weight_packet(parse_grams(message))
+
+    return measure(run, n, repeat, lambda message: weight_packet(parse_grams(message)), messages)
+
+
+async def _connected_scale():
+    scale = AsyncDecentScale(client_factory=FakeBleakClient, fix_dropped_command=False)
+    await scale.connect('FA:KE:00:00:00:01')
+    return scale
+
+
+def bench_notification_e2e(n, repeat):
+    packets = synthetic_stream(n)
+    loop = asyncio.new_event_loop()
+    try:
+        scale = loop.run_until_complete(_connected_scale())
+        notify = scale.client.notify
+
+        def run():
+            for p in packets:
+                notify(p)
+
+        result = measure(run, n, repeat, notify, packets)
+        loop.run_until_complete(scale.disconnect())
+    finally:
+        loop.close()
+    return result
+
+
+def bench_command_rtt(n, repeat):
+    async def run():
+        scale = await _connected_scale()
+        timings = []
+        for _ in range(n * repeat):
+            start = time.perf_counter()
+            await scale.tare()
+            timings.append(time.perf_counter() - start)
+        await scale.disconnect()
+        return timings
+
+    timings = sorted(asyncio.run(run()))
+    return {'calls_per_second': len(timings) / sum(timings),
+            'p50_us': statistics.median(timings) * 1e6,
+            'p99_us': timings[int(len(timings) * 0.99)] * 1e6}
+
+
+# name: (function, items per run)
+BENCHMARKS = {
+    'decoder': (bench_decoder, 10000),
+    'notification_e2e': (bench_notification_e2e, 10000),
+    'tare_command': (bench_tare_command, 10000),
+    'calculate_xor': (bench_calculate_xor, 10000),
+    'usb_frame_parser': (bench_usb_frame_parser, 20000),
+    'usb_legacy_parser': (bench_usb_legacy_parser, 20000),
+    'wifi_parse': (bench_wifi_parse, 10000),
+    'command_rtt': (bench_command_rtt, 200),
+}
+
+
+def run_all(names=None, repeat=5, scale=1.0):
+    results = {}
+    for name, (function, n) in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        results[name] = function(max(int(n * scale), 1), repeat)
+        print('%-18s %s' % (name, '  '.join('%s=%.4g' % item for item in results[name].items())))
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'timestamp': time.time(),
+        'scale': scale,
+        'results': results,
+    }
+
+
+def compare(baseline, current, tolerance):
+    """Lines describing every metric that got worse by more than ``tolerance``"""
+    regressions = []
+    for name, metrics in current['results'].items():
+        previous = baseline['results'].get(name)
+        if previous is None:
+            continue
+        for metric, value in metrics.items():
+            old = previous.get(metric)
+            if not old:
+                continue
+            if abs(value - old) < ALLOCATION_FLOOR.get(metric, 0):
+                continue
+            change = (value - old) / old
+            worse = change > tolerance if metric in LOWER_IS_BETTER else change < -tolerance
+            if worse:
+                regressions.append('%s.%s: %.4g -> %.4g (%+.1f%%)' % (name, metric, old, value, change * 100))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('benchmarks', nargs='*', help='Benchmarks to run (default: all): %s' % ', '.join(BENCHMARKS))
+    parser.add_argument('--save', metavar='JSON', help='Write the results to this file')
+    parser.add_argument('--compare', metavar='JSON', help='Compare with a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative slowdown (default: 0.10)')
+    parser.add_argument('--repeat', type=int, default=5, help='Repeats per benchmark; the best is kept (default: 5)')
+    parser.add_argument('--quick', action='store_true', help='Run a tenth of the packets, for a smoke test')
+    args = parser.parse_args(argv)
+
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error('Unknown benchmarks: %s' % ', '.join(sorted(unknown)))
+
+    if args.compare and not os.path.exists(args.compare):
+        parser.error('No baseline at %s; record one with --save' % args.compare)
+    current = run_all(args.benchmarks, args.repeat, 0.1 if args.quick else 1.0)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(current, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('scale', 1.0) != current['scale']:
+            # Fixed costs weigh differently on fewer packets
+            parser.error('%s was not recorded with the same --quick setting' % args.compare)
+        regressions = compare(baseline, current, args.tolerance)
+        if regressions:
+            print('\nRegressions against %s:' % args.compare)
+            for line in regressions:
+                print('  ' + line)
+            return 1
+        print('\nNo regressions against %s' % args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,16 +6,15 @@
 __version__ = "0.4.0"
 
 import asyncio
-import binascii
-import functools
 import logging
-import operator
 import threading
 import time
-from itertools import cycle
-import sys
 
-from bleak import BleakScanner, BleakClient
+from .async_scale import AsyncDecentScale
+from .cache import DeviceCache
+from .manager import AsyncScaleManager
+from .metrics import ScaleMetrics
+from .stream import WeightSample, WeightStream
 
 logger = logging.getLogger(__name__)
 
@@ -43,368 +42,194 @@ class AsyncioEventLoopThread(threading.Thread):
         self.running = False
 
 
-class DecentScale(AsyncioEventLoopThread):
-    
-    def __init__(self, *args, timeout=20, fix_dropped_command=True, enable_heartbeat=False, **kwargs):
-        super().__init__(*args, **kwargs)
-
-        self.client = None
-        self.timeout=timeout
-        self.connected=False
-        self.fix_dropped_command=fix_dropped_command
-        self.dropped_command_sleep = 0.05  # API Docs says 50ms
-        self.weight = None
-        self.firmware_version = None
-        self.battery_level = None
-        self.weight_unit = 'g'
-        self.enable_heartbeat = enable_heartbeat
-        self.last_heartbeat = None
-        self.heartbeat_task = None
-        self.timestamp = None  # For firmware v1.2+   
-
-        # BLE Characteristics based on the Decent Scale protocol.
-        # The values are derived from the short UUIDs in the JS example:
-        # READ_CHARACTERISTIC: 'fff4'
-        # WRITE_CHARACTERISTIC: '36f5'
-        self.CHAR_READ='0000fff4-0000-1000-8000-00805f9b34fb'
-        self.CHAR_WRITE='000036f5-0000-1000-8000-00805f9b34fb'
-        
-        
-        #Tare command structure updated for new firmware
-        #Byte 6 controls heartbeat: 00=disable, 01=enable
-        
-        self.tare_counter = 0
-                
-        self.led_on_command_grams=bytearray.fromhex('030A0101000009')
-        self.led_on_command_ounces=bytearray.fromhex('030A0101010008')
-        self.led_off_command=bytearray.fromhex('030A0000000009')
-        self.power_off_command=bytearray.fromhex('030A020000000B')
-        self.start_time_command=bytearray.fromhex('030B030000000B')
-        self.stop_time_command=bytearray.fromhex("030B0000000008")
-        self.reset_time_command=bytearray.fromhex("030B020000000A" )
-        self.heartbeat_command=bytearray.fromhex("030A03FFFF000A")
-        
-        self.daemon=True
-        super().start()
-        
-    def check_connection(func):
-        def is_connected(self):
-            if self.connected:
-                func(self)
-            else:
-                logger.warning("Scale is not connected.")
-        return is_connected
-
-    async def _find_device(self):
-        
-        device = await BleakScanner.find_device_by_filter(
-        lambda d, ad: d.name and d.name == 'Decent Scale'
-        ,timeout=self.timeout)
-        
-        if device:
-            return device
-        else:
-            logger.info('Scale not found.')
-    
-
-    def calculate_xor(self, data):
-        """Calculate XOR checksum for the first 6 bytes"""
-        xor = 0
-        for i in range(6):
-            xor ^= data[i]
-        return xor
-    
-    def generate_tare_command(self):
-        """Generate tare command with incrementing counter and heartbeat option"""
-        # Increment counter (0-255)
-        self.tare_counter = (self.tare_counter + 1) % 256
-        
-        # Build command: 03 0F <counter> 00 00 <heartbeat> <xor>
-        cmd = bytearray([0x03, 0x0F, self.tare_counter, 0x00, 0x00, 0x01 if self.enable_heartbeat else 0x00, 0x00])
-        
-        # Calculate and set XOR
-        cmd[6] = self.calculate_xor(cmd)
-        
-        return cmd
-
-    async def _connect_and_setup(self, address):
-        """
-        Connects to the scale, enables notifications, starts the heartbeat (if configured),
-        and sends an initial command to retrieve scale status (firmware, etc.).
-        This consolidates the entire connection sequence into one async operation.
-        """
-        self.client = BleakClient(address)
-        await self.client.connect(timeout=self.timeout)
-
-        # Enable notifications to receive data
-        await self.client.start_notify(self.CHAR_READ, self.notification_handler)
-
-        # Start heartbeat loop if enabled
-        if self.enable_heartbeat and not self.heartbeat_task:
-            self.heartbeat_task = asyncio.create_task(self._heartbeat_loop())
-
-        # Send a command to get scale info (firmware, battery, etc.)
-        await self.__send(self.led_on_command_grams)
-        await asyncio.sleep(0.5)  # Give time for the notification with info to arrive
-        
-    async def _disconnect(self):
-        return await self.client.disconnect()   
-
-    async def __send(self, cmd):
-        """Send commands with firmware v1.0 bugfix (resending)"""
-        await self.client.write_gatt_char(self.CHAR_WRITE, cmd)
-        if self.fix_dropped_command:
-            await asyncio.sleep(self.dropped_command_sleep)
-            await self.client.write_gatt_char(self.CHAR_WRITE, cmd)
-
-        # Wait 200ms for the command to finish
-        # Alternative: receive the notifications and check if the command was acknowledged
-        await asyncio.sleep(0.2)
-
-    async def _tare(self):
-        await self.__send(self.generate_tare_command())
-
-    async def _led_on(self, unit='g'):
-        if unit == 'oz':
-            await self.__send(self.led_on_command_ounces)
-        else:
-            await self.__send(self.led_on_command_grams)
-
-    async def _led_off(self):
-        await self.__send(self.led_off_command)
-    
-    async def _power_off(self):
-        """Power off command (firmware v1.2+)"""
-        await self.__send(self.power_off_command)
-
-    async def _start_time(self):
-        await self.__send(self.start_time_command)
-
-    async def _stop_time(self):
-        await self.__send(self.stop_time_command)
-
-    async def _reset_time(self):
-        await self.__send(self.reset_time_command)
-        
-    async def _send_heartbeat(self):
-        """Send heartbeat command for Half Decent Scale"""
-        if self.enable_heartbeat and self.connected:
-            await self.__send(self.heartbeat_command)
-            
-    async def _heartbeat_loop(self):
-        """Heartbeat loop that runs every 4 seconds"""
-        while self.connected and self.enable_heartbeat:
-            await self._send_heartbeat()
-            await asyncio.sleep(4)  # Send every 4 seconds (requirement is < 5 seconds)
-
-    def notification_handler(self, sender, data):
-        if data[0] != 0x03 or (len(data) != 7 and len(data) != 10):
-            # Basic sanity check - support both 7 and 10 byte messages
-            logger.info("Invalid notification: not a Decent Scale?")
-            return
-
-        # Calculate XOR based on message length
-        if len(data) == 7:
-            xor_msg = functools.reduce(operator.xor, data[:-1])
-        else:  # 10 byte message
-            xor_msg = functools.reduce(operator.xor, data[:-1])
-            
-        if xor_msg != data[-1]:
-            logger.warning("XOR verification failed for notification")
-            return
-            
-        if sys.version_info >= (3, 8):
-            logger.debug(f"Received Notification at {time.time()}: {binascii.hexlify(data, sep=':')}")
-        else:
-            logger.debug(f"Received Notification at {time.time()}: {binascii.hexlify(data)}")
-        
-        # Have to decide by type of the package
-        type_ = data[1]
-
-        if type_ in [0xCA, 0xCE]:
-            # Weight information
-            self.weight = int.from_bytes(data[2:4], byteorder='big', signed=True) / 10
-            
-            # If 10-byte message (firmware v1.2+), extract timestamp
-            if len(data) == 10:
-                minutes = data[4]
-                seconds = data[5]
-                deciseconds = data[6]
-                self.timestamp = {'minutes': minutes, 'seconds': seconds, 'deciseconds': deciseconds}
-                logger.debug(f"Weight: {self.weight}g at {minutes}:{seconds:02d}.{deciseconds}")
-                
-        elif type_ == 0xAA:
-            # Button press
-            logger.debug(f"Button press: {data[2]}, duration: {data[3]}")
-            
-        elif type_ == 0x0F:
-            # Tare response
-            if len(data) >= 7 and data[5] == 0xFE:
-                logger.debug("Tare command confirmed")
-                
-        elif type_ == 0x0A:
-            # LED on/off response -> returns units, battery level, and firmware version
-            if len(data) >= 7:
-                self.weight_unit = 'oz' if data[3] == 0x01 else 'g'
-                self.battery_level = data[4] if data[4] != 0xFF else 'USB'
-                
-                # Firmware version mapping
-                fw_map = {0xFE: '1.0', 0x02: '1.1', 0x03: '1.2'}
-                self.firmware_version = fw_map.get(data[5], f'Unknown ({data[5]:02x})')
-                
-                logger.debug(f"Scale info - Unit: {self.weight_unit}, Battery: {self.battery_level}%, Firmware: {self.firmware_version}")
-                
-        elif type_ == 0x0B:
-            # Timer info
-            pass
-        else:
-            logger.warning(f"Unknown Notification Type received: 0x{type_:02x}")
+class DecentScale(object):
+    """Blocking interface to the Decent Scale.
+
+    A thin wrapper that runs the coroutines of an AsyncDecentScale on a
+    background event loop thread. Attributes such as ``weight``, ``connected``
+    or ``firmware_version`` are read from (and written to) the wrapped
+    ``AsyncDecentScale``. Code that already runs an event loop should use
+    AsyncDecentScale directly.
+
+    ``loop_thread`` and ``scale`` let several wrappers share one loop thread
+    (see ScaleManager) instead of starting a thread per scale.
+    """
+
+    def __init__(self, *args, timeout=20, fix_dropped_command=True, enable_heartbeat=False,
+                 ack_timeout=0.2, command_retries=2, cache=None, auto_reconnect=False, flow_window=1.0,
+                 metrics=False, loop_thread=None, scale=None, **kwargs):
+        if loop_thread is None:
+            loop_thread = AsyncioEventLoopThread(*args, **kwargs)
+            loop_thread.daemon = True
+            loop_thread.start()
+        if scale is None:
+            scale = AsyncDecentScale(
+                timeout=timeout, fix_dropped_command=fix_dropped_command, enable_heartbeat=enable_heartbeat,
+                ack_timeout=ack_timeout, command_retries=command_retries, cache=cache,
+                auto_reconnect=auto_reconnect, flow_window=flow_window, metrics=metrics)
+        object.__setattr__(self, 'thread', loop_thread)
+        object.__setattr__(self, 'scale', scale)
+
+    def __getattr__(self, name):
+        return getattr(self.scale, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.scale, name, value)
+
+    @property
+    def loop(self):
+        return self.thread.loop
+
+    def run_coro(self, coro, wait_for_result=True):
+        metrics = self.scale.metrics
+        if metrics is None or not wait_for_result:
+            return self.thread.run_coro(coro, wait_for_result)
+        start = time.perf_counter()
+        try:
+            return self.thread.run_coro(coro)
+        finally:
+            metrics.sync_call_ms.observe((time.perf_counter() - start) * 1e3)
 
-    async def _enable_notification(self):
-        await self.client.start_notify(self.CHAR_READ, self.notification_handler)
-        
-        # Start heartbeat if enabled
-        if self.enable_heartbeat and not self.heartbeat_task:
-            self.heartbeat_task = asyncio.create_task(self._heartbeat_loop())
-        await asyncio.sleep(0.2) # Short delay to ensure notifications are active
-        
-             
-    async def _disable_notification(self):
-        # Cancel heartbeat task if running
-        if self.heartbeat_task:
-            self.heartbeat_task.cancel()
-            try:
-                await self.heartbeat_task
-            except asyncio.CancelledError:
-                pass
-            self.heartbeat_task = None
-            
-        await self.client.stop_notify(self.CHAR_READ) 
+    def stop(self):
+        """Stop the background event loop thread"""
+        self.thread.stop()
 
-    @check_connection    
     def enable_notification(self):   
-        return self.run_coro(self._enable_notification())
+        return self.run_coro(self.scale.enable_notification())
     
-    @check_connection 
     def disable_notification(self):   
-        self.weight=None
-        return self.run_coro(self._disable_notification())
+        return self.run_coro(self.scale.disable_notification())
 
     def find_device(self):
         """Scan for a Decent Scale and return the BLEDevice object."""
-        return self.run_coro(self._find_device())
+        return self.run_coro(self.scale.find_device())
 
     def find_address(self):
         """Scan for a Decent Scale and return its address.
         Note: Using find_device() and connecting with the device object is more reliable."""
-        device = self.find_device()
-        if device:
-            return device.address
+        return self.run_coro(self.scale.find_address())
     
     def connect(self, address):
-        if self.connected:
-            logger.info('Already connected.')
-            return True
-
-        try:
-            # Run the consolidated connection and setup sequence.
-            # We use the address string, which is more reliable across platforms.
-            self.run_coro(self._connect_and_setup(address))
-            self.connected = True
-            return True
-        except Exception:
-            logger.error("Connection failed", exc_info=True)
-            # Ensure we are fully disconnected on failure
-            if self.client and self.client.is_connected:
-                self.run_coro(self.client.disconnect())
-            self.connected = False
-
-        # If we reach here, connection failed.
-        self.connected = False
-        return False
+        return self.run_coro(self.scale.connect(address))
                 
     def disconnect(self):
-        if self.connected:
-            # Cancel heartbeat task if running
-            if self.heartbeat_task:
-                self.run_coro(self._disable_notification(), wait_for_result=False)
-            
-            self.connected = not self.run_coro(self._disconnect())
-        else:
-            logger.info('Already disconnected.')
-        
-        return not self.connected
+        return self.run_coro(self.scale.disconnect())
             
     def auto_connect(self,n_retries=3):    
-        device = None
-        logger.info("Scanning for Decent Scale...")
-        for i in range(n_retries):
-            device = self.find_device()
-            if device:
-                logger.info('Found Decent Scale: %s', device.address)
-                break
-            else:
-                logger.info('Scan attempt %d failed. Retrying...', i + 1)
-        
-        if device:
-            for i in range(n_retries):
-                # Use the device's address string for connection, mirroring the working test_bleak.py example.
-                if self.connect(device.address):
-                    return True
-                logger.warning('Connection attempt %d failed. Retrying...', i + 1)
-        
-        logger.error('Autoconnect failed. Make sure the scale is on.')
-        return False
+        return self.run_coro(self.scale.auto_connect(n_retries))
     
-    @check_connection 
     def tare(self):   
-        self.run_coro(self._tare())
+        return self.run_coro(self.scale.tare())
         
-    @check_connection 
     def start_time(self):   
-        self.run_coro(self._start_time())
+        return self.run_coro(self.scale.start_time())
     
-    @check_connection 
     def stop_time(self):   
-        self.run_coro(self._stop_time())
+        return self.run_coro(self.scale.stop_time())
                    
-    @check_connection 
     def reset_time(self):   
-        self.run_coro(self._reset_time())
+        return self.run_coro(self.scale.reset_time())
 
-    @check_connection 
     def led_off(self):   
-        self.run_coro(self._led_off())
+        return self.run_coro(self.scale.led_off())
     
-    @check_connection
     def power_off(self):
         """Power off the scale (firmware v1.2+)"""
-        if self.firmware_version and self.firmware_version >= '1.2':
-            self.run_coro(self._power_off())
-        else:
-            logger.warning("Power off command requires firmware v1.2 or newer")
+        return self.run_coro(self.scale.power_off())
                    
-    @check_connection 
     def led_on(self, unit='g'):   
-        self.run_coro(self._led_on(unit))
- 
-    
-    def get_firmware_version(self):
-        """Get the firmware version of the connected scale"""
-        return self.firmware_version
-    
-    def get_battery_level(self):
-        """Get the battery level (percentage or 'USB' if USB powered)"""
-        return self.battery_level
-    
-    def get_weight_unit(self):
-        """Get the current weight unit displayed on scale ('g' or 'oz')"""
-        return self.weight_unit
-    
-    def get_weight_with_timestamp(self):
-        """Get weight with timestamp (firmware v1.2+ only)"""
-        if self.timestamp:
-            return {'weight': self.weight, 'timestamp': self.timestamp}
-        return {'weight': self.weight, 'timestamp': None}
+        return self.run_coro(self.scale.led_on(unit))
+
+    def record(self, path, buffer_size=64 * 1024):
+        """Append every notification to the binary session file ``path``"""
+        return self.run_coro(self._call(self.scale.record, path, buffer_size))
+
+    def stop_recording(self):
+        """Stop recording and close the session file"""
+        return self.run_coro(self._call(self.scale.stop_recording))
+
+    @staticmethod
+    async def _call(func, *args):
+        # Run a plain method on the loop thread, so it cannot interleave with
+        # a notification being handled there
+        return func(*args)
+
+    def wait_connected(self, timeout=None):
+        """Block until the scale is connected (e.g. after an automatic reconnect)"""
+        return self.run_coro(self.scale.wait_connected(timeout))
+
+    def weights(self, capacity=256, overflow='drop_oldest', block_timeout=1.0):
+        """Stream every weight sample to a blocking iterator.
+
+        Samples are buffered in a ring buffer of ``capacity`` samples. When the
+        consumer falls behind, ``overflow`` decides whether the oldest sample
+        is overwritten ('drop_oldest'), the new one is discarded
+        ('drop_newest'), or the notification thread waits up to
+        ``block_timeout`` seconds for space ('block').
+
+            with ds.weights() as stream:
+                for sample in stream:
+                    print(sample.weight)
+        """
+        return self.scale.subscribe(WeightStream(capacity, overflow, block_timeout,
+                                                 on_close=self.scale.unsubscribe))
 
-        
+
+class ScaleManager(object):
+    """Blocking interface to AsyncScaleManager.
+
+    All scales share one background event loop thread. Scales are exposed by
+    address as DecentScale objects:
+
+        manager = ScaleManager()
+        manager.auto_connect(expected=6)
+        for address, ds in manager.scales.items():
+            ds.tare()
+    """
+
+    def __init__(self, timeout=20, **scale_kwargs):
+        self.thread = AsyncioEventLoopThread()
+        self.thread.daemon = True
+        self.thread.start()
+        self.manager = AsyncScaleManager(timeout=timeout, **scale_kwargs)
+        self.scales = {}
+
+    def __getitem__(self, address):
+        return self.scales[address]
+
+    def __iter__(self):
+        return iter(self.scales.values())
+
+    def __len__(self):
+        return len(self.scales)
+
+    def run_coro(self, coro, wait_for_result=True):
+        return self.thread.run_coro(coro, wait_for_result)
+
+    def _wrap_scales(self):
+        for address, scale in self.manager.scales.items():
+            if address not in self.scales:
+                self.scales[address] = DecentScale(loop_thread=self.thread, scale=scale)
+
+    def discover(self, scan_time=5.0, expected=None):
+        """Scan once and return every Decent Scale found"""
+        return self.run_coro(self.manager.discover(scan_time, expected))
+
+    def connect_all(self, devices=None):
+        """Connect concurrently to ``devices`` (default: every discovered scale)"""
+        results = self.run_coro(self.manager.connect_all(devices))
+        self._wrap_scales()
+        return results
+
+    def auto_connect(self, scan_time=5.0, expected=None):
+        """Discover all scales with a single scan and connect to them"""
+        results = self.run_coro(self.manager.auto_connect(scan_time, expected))
+        self._wrap_scales()
+        return results
+
+    def disconnect_all(self):
+        return self.run_coro(self.manager.disconnect_all())
+
+    def stop(self):
+        """Stop the shared event loop thread"""
+        self.thread.stop()
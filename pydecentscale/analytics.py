@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Vectorized shot statistics for recorded weight sessions.
+
+Sessions are stored as columnar NumPy arrays: the samples of all sessions
+are concatenated into one ``t`` (seconds) and one ``w`` (grams) array, and
+``lengths`` gives the number of samples of each session. Every metric is
+computed for all sessions at once with segment reductions
+(``ufunc.reduceat``), so thousands of sessions of different lengths are
+processed without a Python loop over samples.
+
+Requires NumPy (``pip install pydecentscale[analytics]``).
+"""
+
+import numpy as np
+
+
+def session_arrays(samples, use_device_time=True):
+    """Convert a sequence of WeightSample into ``(t, w)`` arrays.
+
+    ``t`` is in seconds from the first sample. The scale timer is used when
+    every sample carries one (firmware v1.2+) and ``use_device_time`` is
+    set, otherwise the host monotonic time.
+    """
+    n = len(samples)
+    w = np.fromiter((s.weight for s in samples), dtype=np.float64, count=n)
+    if not n:
+        return np.empty(0), w
+    if use_device_time and all(s.device_time is not None for s in samples):
+        t = np.fromiter((s.device_time for s in samples), dtype=np.int64, count=n)
+        return (t - t[0]) * 0.1, w
+    t = np.fromiter((s.host_ns for s in samples), dtype=np.int64, count=n)
+    return (t - t[0]) * 1e-9, w
+
+
+def pack_sessions(sessions, use_device_time=True):
+    """Concatenate sessions into columnar ``(t, w, lengths)`` arrays.
+
+    Each session is either a sequence of WeightSample or a ``(t, w)`` pair
+    of arrays.
+    """
+    ts, ws = [], []
+    for session in sessions:
+        if isinstance(session, tuple) and len(session) == 2 and not hasattr(session[0], 'weight'):
+            t, w = (np.asarray(a, dtype=np.float64) for a in session)
+        else:
+            t, w = session_arrays(session, use_device_time)
+        ts.append(t)
+        ws.append(w)
+    lengths = np.fromiter((len(t) for t in ts), dtype=np.int64, count=len(ts))
+    if not ts:
+        return np.empty(0), np.empty(0), lengths
+    return np.concatenate(ts), np.concatenate(ws), lengths
+
+
+def _segments(lengths):
+    """Start offsets of the non-empty sessions, and the mask selecting them"""
+    starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    nonempty = lengths > 0
+    return starts, nonempty
+
+
+def _scatter(values, nonempty, fill=np.nan):
+    out = np.full(len(nonempty), fill, dtype=np.float64)
+    out[nonempty] = values
+    return out
+
+
+def _first_time(mask, rel_t, starts, ends):
+    """Per session, the relative time of the first sample where ``mask`` holds (NaN if none)"""
+    n = len(mask)
+    index = np.where(mask, np.arange(n), n)
+    first = np.minimum.reduceat(index, starts)
+    found = first < ends
+    result = np.full(len(starts), np.nan)
+    result[found] = rel_t[first[found]]
+    return result
+
+
+def shot_statistics(t, w, lengths=None, target=None, drip_threshold=1.0, flow_span=5, settle_time=2.0):
+    """Compute shot statistics for every session in one pass.
+
+    ``t`` and ``w`` are the concatenated times (s) and weights (g) of all
+    sessions and ``lengths`` the number of samples per session (default: a
+    single session). ``target`` is a yield in grams, either a scalar or one
+    value per session.
+
+    Returns a dict of arrays with one value per session (NaN where a metric
+    is undefined):
+
+    - ``yield``: final weight
+    - ``duration``: time from the first to the last sample
+    - ``time_to_first_drip``: time until the weight first reaches ``drip_threshold``
+    - ``time_to_target``: time until the weight first reaches ``target``
+    - ``peak_flow``: highest flow in g/s, measured over ``flow_span`` samples
+    - ``mean_flow``: yield divided by the time from first drip to the end
+    - ``noise``: standard deviation of sample-to-sample weight changes
+    - ``stability``: standard deviation of the weight over the last ``settle_time`` seconds
+    """
+    t = np.asarray(t, dtype=np.float64)
+    w = np.asarray(w, dtype=np.float64)
+    if lengths is None:
+        lengths = np.array([len(t)], dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if len(t) != len(w) or lengths.sum() != len(t):
+        raise ValueError("t, w and lengths describe different numbers of samples")
+
+    all_starts, nonempty = _segments(lengths)
+    starts = all_starts[nonempty]
+    counts = lengths[nonempty]
+    ends = starts + counts
+    stats = {}
+    if not len(starts):
+        for name in ('yield', 'duration', 'time_to_first_drip', 'time_to_target',
+                     'peak_flow', 'mean_flow', 'noise', 'stability'):
+            stats[name] = np.full(len(lengths), np.nan)
+        return stats
+
+    session = np.repeat(np.arange(len(starts)), counts)
+    rel_t = t - t[starts][session]
+    duration = rel_t[ends - 1]
+    final = w[ends - 1]
+
+    drip = _first_time(w >= drip_threshold, rel_t, starts, ends)
+
+    if target is None:
+        to_target = np.full(len(starts), np.nan)
+    else:
+        target = np.broadcast_to(np.asarray(target, dtype=np.float64), lengths.shape)[nonempty]
+        to_target = _first_time(w >= target[session], rel_t, starts, ends)
+
+    # Flow over flow_span samples; pairs that cross a session boundary are masked out
+    n = len(w)
+    span = max(1, flow_span)
+    flow = np.full(n, -np.inf)
+    if n > span:
+        dt = t[span:] - t[:-span]
+        valid = (session[span:] == session[:-span]) & (dt > 0)
+        flow[:-span][valid] = (w[span:] - w[:-span])[valid] / dt[valid]
+    peak_flow = np.maximum.reduceat(flow, starts)
+    peak_flow[~np.isfinite(peak_flow)] = np.nan
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_flow = final / (duration - drip)
+    mean_flow[~np.isfinite(mean_flow)] = np.nan
+
+    # Sample-to-sample changes within each session
+    step = np.zeros(n)
+    step[1:] = np.diff(w)
+    step[starts] = 0.0
+    step_count = counts - 1
+    step_sum = np.add.reduceat(step, starts)
+    step_sq = np.add.reduceat(step * step, starts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        step_mean = step_sum / step_count
+        noise = np.sqrt(np.maximum(step_sq / step_count - step_mean * step_mean, 0.0))
+    noise[step_count < 2] = np.nan
+
+    # Weight spread over the settling window at the end of each session
+    settling = rel_t >= (duration - settle_time)[session]
+    settle_count = np.add.reduceat(settling.astype(np.float64), starts)
+    settle_mean = np.add.reduceat(np.where(settling, w, 0.0), starts) / settle_count
+    deviation = np.where(settling, w - settle_mean[session], 0.0)
+    stability = np.sqrt(np.add.reduceat(deviation * deviation, starts) / settle_count)
+
+    stats['yield'] = _scatter(final, nonempty)
+    stats['duration'] = _scatter(duration, nonempty)
+    stats['time_to_first_drip'] = _scatter(drip, nonempty)
+    stats['time_to_target'] = _scatter(to_target, nonempty)
+    stats['peak_flow'] = _scatter(peak_flow, nonempty)
+    stats['mean_flow'] = _scatter(mean_flow, nonempty)
+    stats['noise'] = _scatter(noise, nonempty)
+    stats['stability'] = _scatter(stability, nonempty)
+    return stats
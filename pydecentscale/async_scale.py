@@ -0,0 +1,571 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Native asyncio interface to the Decent Scale.
+
+AsyncDecentScale runs on the caller's event loop: every command is a
+coroutine and no extra thread is started. The synchronous DecentScale class
+is a thin wrapper that runs these coroutines on a background loop.
+"""
+
+import asyncio
+import functools
+import logging
+import random
+import time
+
+from bleak import BleakScanner
+
+from . import commands
+from .command_queue import CommandQueue, HIGH, NORMAL, LOW
+from .decoder import NotificationDecoder
+from .flow import FlowEstimator
+from .metrics import ScaleMetrics
+from .recorder import SessionRecorder
+from .stream import WeightStream, DROP_OLDEST, BLOCK
+from .transport import client_for
+
+logger = logging.getLogger(__name__)
+
+# Name advertised by the scale over BLE
+DEVICE_NAME = 'Decent Scale'
+
+# Seconds without a command after which a Half Decent Scale disconnects
+HEARTBEAT_TIMEOUT = 5.0
+
+# Connection states reported to state callbacks
+DISCONNECTED = 'disconnected'
+CONNECTING = 'connecting'
+CONNECTED = 'connected'
+RECONNECTING = 'reconnecting'
+
+
+def check_connection(func):
+    @functools.wraps(func)
+    async def is_connected(self, *args, **kwargs):
+        if self.connected:
+            return await func(self, *args, **kwargs)
+        else:
+            logger.warning("Scale is not connected.")
+    return is_connected
+
+
+class AsyncDecentScale(object):
+
+    def __init__(self, timeout=20, fix_dropped_command=True, enable_heartbeat=False,
+                 ack_timeout=0.2, command_retries=2, cache=None,
+                 auto_reconnect=False, reconnect_delay=1.0, reconnect_max_delay=60.0, flow_window=1.0,
+                 client_factory=None, scanner=None, metrics=False):
+
+        self.client = None
+        # Called like BleakClient(address, disconnected_callback=...). The default
+        # picks BLE, USB or WiFi from the address (see pydecentscale.transport);
+        # replaced by fake clients for replays and tests without Bluetooth
+        self.client_factory = client_factory or client_for
+        self.scanner = scanner or BleakScanner
+        self.address = None
+        self.cache = cache  # Optional DeviceCache for fast reconnects
+        self.timeout=timeout
+        self.connected=False
+        self.state = DISCONNECTED
+        self.state_callbacks = []  # Called with (scale, state) on every state change
+        self.auto_reconnect = auto_reconnect
+        self.reconnect_delay = reconnect_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.supervisor_task = None
+        self._closing = False
+        self.fix_dropped_command=fix_dropped_command
+        self.dropped_command_sleep = 0.05  # API Docs says 50ms
+        self.ack_timeout = ack_timeout
+        self.command_retries = command_retries
+        self.notifying = False
+        self.weight = None
+        self.firmware_version = None
+        self.battery_level = None
+        self.weight_unit = 'g'
+        self.enable_heartbeat = enable_heartbeat
+        # The heartbeat is only sent when no other command was written for
+        # HEARTBEAT_TIMEOUT - heartbeat_margin seconds
+        self.heartbeat_margin = 1.0
+        self.last_heartbeat = None
+        self.last_write = None  # loop time of the last command written
+        self.heartbeat_task = None
+        self.sample = None  # Last WeightSample
+        self.flow = FlowEstimator(flow_window)
+        self.notification_handler = NotificationDecoder(self)
+        self.notification_handler.listeners = [self.flow.update]
+        self.command_queue = CommandQueue(self, self.__write)
+        self.metrics = None  # ScaleMetrics, see enable_metrics()
+        if metrics:
+            self.enable_metrics(metrics if isinstance(metrics, ScaleMetrics) else None)
+
+        # BLE Characteristics based on the Decent Scale protocol.
+        # The values are derived from the short UUIDs in the JS example:
+        # READ_CHARACTERISTIC: 'fff4'
+        # WRITE_CHARACTERISTIC: '36f5'
+        self.CHAR_READ='0000fff4-0000-1000-8000-00805f9b34fb'
+        self.CHAR_WRITE='000036f5-0000-1000-8000-00805f9b34fb'
+
+
+        #Tare command structure updated for new firmware
+        #Byte 6 controls heartbeat: 00=disable, 01=enable
+
+        self.tare_counter = 0
+
+        # Command frames are immutable and shared by all scales (see commands.py)
+        self.led_on_command_grams = commands.LED_ON_GRAMS
+        self.led_on_command_ounces = commands.LED_ON_OUNCES
+        self.led_off_command = commands.LED_OFF
+        self.power_off_command = commands.POWER_OFF
+        self.start_time_command = commands.START_TIMER
+        self.stop_time_command = commands.STOP_TIMER
+        self.reset_time_command = commands.RESET_TIMER
+        self.heartbeat_command = commands.HEARTBEAT
+
+    async def find_device(self):
+        """Scan for a Decent Scale and return the BLEDevice object."""
+        device = await self.scanner.find_device_by_filter(
+        lambda d, ad: d.name and d.name == DEVICE_NAME
+        ,timeout=self.timeout)
+
+        if device:
+            return device
+        else:
+            logger.info('Scale not found.')
+
+    async def find_address(self):
+        """Scan for a Decent Scale and return its address.
+        Note: Using find_device() and connecting with the device object is more reliable."""
+        device = await self.find_device()
+        if device:
+            return device.address
+
+    def calculate_xor(self, data):
+        """Calculate XOR checksum for the first 6 bytes"""
+        return commands.checksum(data)
+
+    def generate_tare_command(self):
+        """Generate tare command with incrementing counter and heartbeat option"""
+        # Increment counter (0-255)
+        self.tare_counter = (self.tare_counter + 1) % 256
+
+        # Precomputed frame: 03 0F <counter> 00 00 <heartbeat> <xor>
+        return commands.TARE[1 if self.enable_heartbeat else 0][self.tare_counter]
+
+    async def _connect_and_setup(self, address):
+        """
+        Connects to the scale, enables notifications, starts the heartbeat (if configured),
+        and sends an initial command to retrieve scale status (firmware, etc.).
+        This consolidates the entire connection sequence into one async operation.
+        """
+        self.client = self.client_factory(address, disconnected_callback=self._on_disconnect)
+        await self.client.connect(timeout=self.timeout)
+
+        # Enable notifications to receive data
+        await self.client.start_notify(self.CHAR_READ, self.notification_handler)
+        self.notifying = True
+
+        # Start heartbeat loop if enabled
+        if self.enable_heartbeat and not self.heartbeat_task:
+            self.heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+
+        # Send a command to get scale info (firmware, battery, etc.).
+        # The 0x0A acknowledgement carries the info, so no extra wait is needed.
+        # When the firmware is already known from the device cache, the
+        # connection does not wait for it: the request refreshes battery
+        # level and unit in the background.
+        if self.firmware_version is None:
+            await self.__send(self.led_on_command_grams, ack=0x0A, priority=LOW, coalesce='led')
+        else:
+            cmd = self.led_on_command_ounces if self.weight_unit == 'oz' else self.led_on_command_grams
+            future = self.command_queue.submit(cmd, 0x0A, LOW, 'led')
+            future.add_done_callback(self._info_refreshed)
+
+    def _info_refreshed(self, future):
+        """Store the scale info of a background info request in the device cache"""
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.warning("Could not refresh the scale info: %s", future.exception())
+        elif future.result() and self.cache is not None and self.address is not None:
+            self.cache.update(self.address, firmware_version=self.firmware_version,
+                              battery_level=self.battery_level, weight_unit=self.weight_unit)
+
+    async def connect(self, address):
+        """Connect to the scale at ``address``: a BLE address or BLEDevice, 'usb', or
+        'ws://host' for WiFi (see pydecentscale.transport)"""
+        if self.connected:
+            logger.info('Already connected.')
+            return True
+
+        self.address = getattr(address, 'address', address)
+        cached = self.cache.get(self.address) if self.cache is not None else None
+        if cached and not self.firmware_version:
+            self.firmware_version = cached.get('firmware_version')
+            self.battery_level = cached.get('battery_level')
+            self.weight_unit = cached.get('weight_unit', self.weight_unit)
+
+        self._closing = False
+        if self.state != RECONNECTING:
+            self._set_state(CONNECTING)
+        try:
+            # Run the consolidated connection and setup sequence.
+            # We use the address string, which is more reliable across platforms.
+            await self._connect_and_setup(address)
+            self.connected = True
+            self._set_state(CONNECTED)
+            if self.cache is not None:
+                self.cache.update(self.address, firmware_version=self.firmware_version,
+                                  battery_level=self.battery_level, weight_unit=self.weight_unit)
+            return True
+        except Exception:
+            logger.error("Connection failed", exc_info=True)
+            # Ensure we are fully disconnected on failure
+            await self._stop_heartbeat()
+            self.notifying = False
+            self.command_queue.clear()
+            if self.client and self.client.is_connected:
+                await self.client.disconnect()
+            if cached:
+                # Do not trust cached info for a scale we could not reach
+                self.firmware_version = None
+
+        # If we reach here, connection failed.
+        self.connected = False
+        if self.state != RECONNECTING:
+            self._set_state(DISCONNECTED)
+        return False
+
+    async def disconnect(self):
+        self._closing = True
+        if self.supervisor_task:
+            self.supervisor_task.cancel()
+            self.supervisor_task = None
+
+        if self.connected:
+            await self._stop_heartbeat()
+            self.notifying = False
+            self.command_queue.clear()
+            await self.client.disconnect()
+            self.connected = False
+        else:
+            logger.info('Already disconnected.')
+
+        self._set_state(DISCONNECTED)
+        return not self.connected
+
+    def _set_state(self, state):
+        if state == self.state:
+            return
+        self.state = state
+        for callback in self.state_callbacks:
+            try:
+                callback(self, state)
+            except Exception:
+                logger.error("Connection state callback failed", exc_info=True)
+
+    def _on_disconnect(self, client):
+        """BleakClient disconnected callback; also called for link drops"""
+        if client is not self.client or self._closing or not self.connected:
+            return
+
+        logger.warning('Scale %s disconnected unexpectedly.', self.address)
+        if self.metrics is not None:
+            self.metrics.disconnects += 1
+        self.connected = False
+        self.notifying = False
+        self.command_queue.clear()
+        self.weight = None
+        self.sample = None
+        self.flow.reset()
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+            self.heartbeat_task = None
+        self._set_state(DISCONNECTED)
+
+        if self.auto_reconnect and self.supervisor_task is None:
+            self.supervisor_task = asyncio.ensure_future(self._reconnect_loop())
+
+    async def _reconnect_loop(self):
+        """Reconnect with jittered exponential backoff until connected or disconnect() is called.
+        connect() restores notifications and the heartbeat."""
+        delay = self.reconnect_delay
+        try:
+            self._set_state(RECONNECTING)
+            while not self.connected and not self._closing:
+                logger.info('Reconnecting to %s...', self.address)
+                if await self.connect(self.address):
+                    logger.info('Reconnected to %s.', self.address)
+                    if self.metrics is not None:
+                        self.metrics.reconnects += 1
+                    break
+                await asyncio.sleep(random.uniform(delay / 2, delay))
+                delay = min(delay * 2, self.reconnect_max_delay)
+        finally:
+            self.supervisor_task = None
+            if not self.connected:
+                self._set_state(DISCONNECTED)
+
+    async def wait_connected(self, timeout=None):
+        """Wait until the scale is connected (e.g. after a reconnect). Returns the connection status."""
+        if self.connected:
+            return True
+        future = asyncio.get_event_loop().create_future()
+
+        def on_state(scale, state):
+            if state == CONNECTED and not future.done():
+                future.set_result(True)
+
+        self.state_callbacks.append(on_state)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.state_callbacks.remove(on_state)
+
+    async def auto_connect(self, n_retries=3):
+        if self.cache is not None:
+            address = self.cache.last_address()
+            if address:
+                logger.info('Trying cached Decent Scale: %s', address)
+                if await self.connect(address):
+                    return True
+                logger.info('Cached scale not reachable, falling back to a scan.')
+
+        device = None
+        logger.info("Scanning for Decent Scale...")
+        for i in range(n_retries):
+            device = await self.find_device()
+            if device:
+                logger.info('Found Decent Scale: %s', device.address)
+                break
+            else:
+                logger.info('Scan attempt %d failed. Retrying...', i + 1)
+
+        if device:
+            for i in range(n_retries):
+                # Use the device's address string for connection, mirroring the working test_bleak.py example.
+                if await self.connect(device.address):
+                    return True
+                logger.warning('Connection attempt %d failed. Retrying...', i + 1)
+
+        logger.error('Autoconnect failed. Make sure the scale is on.')
+        return False
+
+    async def __write(self, cmd, resend=True):
+        """Write a command, resending it once for the firmware v1.0 dropped command bug.
+
+        Only the command queue writes, one command at a time, so the heartbeat
+        never interleaves with a command and its resend. Every write pushes the
+        heartbeat deadline back.
+        """
+        self.last_write = asyncio.get_event_loop().time()
+        metrics = self.metrics
+        if metrics is None:
+            await self.client.write_gatt_char(self.CHAR_WRITE, cmd)
+        else:
+            start = time.perf_counter()
+            await self.client.write_gatt_char(self.CHAR_WRITE, cmd)
+            metrics.write_ms.observe((time.perf_counter() - start) * 1e3)
+        if resend and self.fix_dropped_command and self.firmware_version == '1.0':
+            await asyncio.sleep(self.dropped_command_sleep)
+            await self.client.write_gatt_char(self.CHAR_WRITE, cmd)
+
+    async def __send(self, cmd, ack=None, priority=NORMAL, coalesce=None, resend=True):
+        """Send a command through the command queue and wait for its acknowledgement.
+
+        ``ack`` is the key the decoder resolves when the scale confirms the
+        command (see NotificationDecoder.pending). The call returns as soon as
+        the acknowledgement arrives; the command is resent up to
+        ``command_retries`` times if none arrives within ``ack_timeout``.
+        Commands without an acknowledgement (or sent while notifications are
+        disabled, or over a link on which the scale does not answer) return
+        once written. See pydecentscale.command_queue for ``priority`` and
+        ``coalesce``.
+        """
+        future = self.command_queue.submit(cmd, ack, priority, coalesce, resend)
+        if coalesce is not None:
+            # A cancelled caller must not cancel a result shared with the
+            # callers of coalesced commands
+            future = asyncio.shield(future)
+        return await future
+
+    @check_connection
+    async def tare(self):
+        cmd = self.generate_tare_command()
+        return await self.__send(cmd, ack=(0x0F, cmd[2]), priority=HIGH)
+
+    @check_connection
+    async def led_on(self, unit='g'):
+        """Turn on the LED display ('g' for grams, 'oz' for ounces)"""
+        if unit == 'oz':
+            return await self.__send(self.led_on_command_ounces, ack=0x0A, priority=LOW, coalesce='led')
+        else:
+            return await self.__send(self.led_on_command_grams, ack=0x0A, priority=LOW, coalesce='led')
+
+    @check_connection
+    async def led_off(self):
+        return await self.__send(self.led_off_command, ack=0x0A, priority=LOW, coalesce='led')
+
+    @check_connection
+    async def power_off(self):
+        """Power off the scale (firmware v1.2+)"""
+        if self.firmware_version and self.firmware_version >= '1.2':
+            return await self.__send(self.power_off_command)
+        else:
+            logger.warning("Power off command requires firmware v1.2 or newer")
+
+    @check_connection
+    async def start_time(self):
+        return await self.__send(self.start_time_command, priority=HIGH)
+
+    @check_connection
+    async def stop_time(self):
+        return await self.__send(self.stop_time_command, priority=HIGH)
+
+    @check_connection
+    async def reset_time(self):
+        return await self.__send(self.reset_time_command, priority=HIGH)
+
+    async def _send_heartbeat(self):
+        """Send heartbeat command for Half Decent Scale (a single write, no acknowledgement)"""
+        if self.enable_heartbeat and self.connected:
+            await self.__send(self.heartbeat_command, priority=LOW, coalesce='heartbeat', resend=False)
+            self.last_heartbeat = self.last_write
+
+    async def _heartbeat_loop(self):
+        """Keep a Half Decent Scale connected until cancelled.
+
+        The scale disconnects when no command arrives for HEARTBEAT_TIMEOUT
+        seconds, and any command counts. The heartbeat is therefore only sent
+        when nothing else was written for ``heartbeat_margin`` seconds less
+        than that, so during a shot it stays out of the way of tare and timer
+        commands.
+        """
+        loop = asyncio.get_event_loop()
+        while self.enable_heartbeat:
+            interval = HEARTBEAT_TIMEOUT - self.heartbeat_margin
+            delay = (self.last_write or 0.0) + interval - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif self.connected:
+                await self._send_heartbeat()
+            else:
+                await asyncio.sleep(interval)
+
+    async def _stop_heartbeat(self):
+        # Cancel heartbeat task if running
+        if self.heartbeat_task:
+            self.heartbeat_task.cancel()
+            try:
+                await self.heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self.heartbeat_task = None
+
+    @check_connection
+    async def enable_notification(self):
+        await self.client.start_notify(self.CHAR_READ, self.notification_handler)
+        self.notifying = True
+
+        # Start heartbeat if enabled
+        if self.enable_heartbeat and not self.heartbeat_task:
+            self.heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        await asyncio.sleep(0.2) # Short delay to ensure notifications are active
+
+    @check_connection
+    async def disable_notification(self):
+        self.weight = None
+        self.sample = None
+        self.flow.reset()
+        await self._stop_heartbeat()
+        self.notifying = False
+        await self.client.stop_notify(self.CHAR_READ)
+
+    def weights(self, capacity=256, overflow=DROP_OLDEST):
+        """Stream every weight sample as notifications arrive.
+
+        Returns a WeightStream of WeightSample records, buffered in a ring
+        buffer of ``capacity`` samples. ``overflow`` is 'drop_oldest' or
+        'drop_newest'; 'block' would stall the event loop that feeds the
+        stream and is only available from the blocking DecentScale.weights().
+
+            async with scale.weights() as stream:
+                async for sample in stream:
+                    print(sample.weight)
+        """
+        if overflow == BLOCK:
+            raise ValueError("overflow='block' cannot be used on the scale's own event loop")
+        return self.subscribe(WeightStream(capacity, overflow, on_close=self.unsubscribe))
+
+    def record(self, path, buffer_size=64 * 1024):
+        """Append every notification to the binary session file ``path``.
+        Returns the SessionRecorder; see pydecentscale.recorder."""
+        self.stop_recording()
+        recorder = self.notification_handler.recorder = SessionRecorder(path, buffer_size)
+        return recorder
+
+    def stop_recording(self):
+        recorder = self.notification_handler.recorder
+        if recorder is not None:
+            self.notification_handler.recorder = None
+            recorder.close()
+
+    def enable_metrics(self, metrics=None):
+        """Start collecting counters and latency histograms (see
+        pydecentscale.metrics). Returns the ScaleMetrics."""
+        if metrics is None:
+            metrics = self.metrics or ScaleMetrics()
+        self.metrics = self.notification_handler.metrics = metrics
+        return metrics
+
+    def disable_metrics(self):
+        self.metrics = self.notification_handler.metrics = None
+
+    def subscribe(self, stream):
+        """Feed every weight sample to ``stream`` until it is closed"""
+        decoder = self.notification_handler
+        decoder.listeners = decoder.listeners + [stream.put]
+        return stream
+
+    def unsubscribe(self, stream):
+        decoder = self.notification_handler
+        decoder.listeners = [l for l in decoder.listeners if l != stream.put]
+
+    @property
+    def flow_rate(self):
+        """Flow rate in g/s over the last ``flow_window`` seconds, or None"""
+        return self.flow.flow_rate
+
+    @property
+    def device_time(self):
+        """Scale timer of the last weight in deciseconds (firmware v1.2+)"""
+        if self.sample is not None:
+            return self.sample.device_time
+
+    @property
+    def timestamp(self):
+        """Timestamp of the last weight as a dict of minutes, seconds, deciseconds (firmware v1.2+)"""
+        if self.sample is not None:
+            return self.sample.timestamp
+
+    def get_firmware_version(self):
+        """Get the firmware version of the connected scale"""
+        return self.firmware_version
+
+    def get_battery_level(self):
+        """Get the battery level (percentage or 'USB' if USB powered)"""
+        return self.battery_level
+
+    def get_weight_unit(self):
+        """Get the current weight unit displayed on scale ('g' or 'oz')"""
+        return self.weight_unit
+
+    def get_weight_with_timestamp(self):
+        """Get weight with timestamp (firmware v1.2+ only)"""
+        if self.sample is not None:
+            return self.sample.as_dict()
+        return {'weight': self.weight, 'timestamp': None}
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Persistent cache of known scales for fast reconnects.
+
+The cache is a small JSON file mapping each scale address to what was
+learned about it on the last connection (firmware, battery, unit). With it,
+auto_connect() can try the last address straight away instead of scanning,
+and connect() can skip the initial info request when the firmware is known.
+"""
+
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def default_cache_path():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pydecentscale', 'devices.json')
+
+
+class DeviceCache(object):
+    """JSON file of known scales keyed by address.
+
+        cache = DeviceCache()          # ~/.cache/pydecentscale/devices.json
+        ds = DecentScale(cache=cache)
+        ds.auto_connect()              # tries the cached address before scanning
+    """
+
+    def __init__(self, path=None):
+        self.path = path or default_cache_path()
+        self.devices = self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                devices = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable device cache %s", self.path, exc_info=True)
+            return {}
+        return devices if isinstance(devices, dict) else {}
+
+    def save(self):
+        """Write the cache atomically so a crash never leaves a truncated file"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.devices, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def get(self, address):
+        """Return the cached info for ``address``, or None"""
+        return self.devices.get(address)
+
+    def update(self, address, save=True, **info):
+        """Merge ``info`` into the entry for ``address`` and mark it as last connected"""
+        entry = self.devices.setdefault(address, {})
+        entry.update(info)
+        entry['last_connected'] = time.time()
+        if save:
+            self.save()
+        return entry
+
+    def remove(self, address, save=True):
+        if self.devices.pop(address, None) is not None and save:
+            self.save()
+
+    def addresses(self):
+        """Cached addresses, most recently connected first"""
+        return sorted(self.devices, key=lambda a: self.devices[a].get('last_connected', 0), reverse=True)
+
+    def last_address(self):
+        addresses = self.addresses()
+        return addresses[0] if addresses else None
@@ -0,0 +1,252 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Serialized, prioritized command queue of one scale.
+
+Every command of an AsyncDecentScale goes through its ``command_queue``. A
+single writer task writes them to the link one at a time, in priority order
+and then in submission order:
+
+    HIGH    tare, timer start/stop/reset
+    NORMAL  power off and other commands
+    LOW     LED and heartbeat
+
+Waiting for an acknowledgement does not hold the link: the next command is
+written as soon as the previous write completes, and only commands with the
+same acknowledgement key (the LED commands share one) wait for each other.
+A queued command with the same ``coalesce`` key as a new one is replaced by
+it, and both callers get the result of the command sent, so several
+led_on() calls in a row write a single LED command.
+
+``submit()`` returns a future that is True once the scale acknowledges the
+command (or once it is written, for commands without acknowledgement) and
+False when no acknowledgement arrived after all retries or the link was
+lost first. A failed write sets the exception on the future.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+
+logger = logging.getLogger(__name__)
+
+HIGH = 0
+NORMAL = 1
+LOW = 2
+
+
+class _Command(object):
+
+    __slots__ = ('priority', 'seq', 'cmd', 'ack', 'coalesce', 'resend', 'future',
+                 'attempts', 'start', 'ack_future', 'timer')
+
+    def __init__(self, priority, seq, cmd, ack, coalesce, resend, future):
+        self.priority = priority
+        self.seq = seq
+        self.cmd = cmd
+        self.ack = ack
+        self.coalesce = coalesce
+        self.resend = resend
+        self.future = future
+        self.attempts = 0
+        self.start = None
+        self.ack_future = None
+        self.timer = None
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class _Acknowledgement(object):
+    """Stands in for a future in NotificationDecoder.pending, so the
+    acknowledging packet completes the command without another loop iteration"""
+
+    __slots__ = ('queue', 'command', 'packet')
+
+    def __init__(self, queue, command):
+        self.queue = queue
+        self.command = command
+        self.packet = None
+
+    def done(self):
+        return self.packet is not None
+
+    def set_result(self, packet):
+        self.packet = packet
+        self.queue._acknowledged(self.command, self)
+
+
+class CommandQueue(object):
+    """Commands waiting to be written to ``scale``.
+
+    ``write(cmd, resend)`` is the coroutine writing one command to the link.
+    Acknowledgement timeout, retries and metrics are read from the scale
+    (``ack_timeout``, ``command_retries``, ``metrics``) for every command.
+    """
+
+    def __init__(self, scale, write):
+        self.scale = scale
+        self.write = write
+        self.queue = []       # heap of _Command
+        self.queued = {}      # coalesce key -> queued _Command
+        self.in_flight = {}   # ack key -> written _Command waiting for its acknowledgement
+        self.writing = None
+        self.writer_task = None
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def submit(self, cmd, ack=None, priority=NORMAL, coalesce=None, resend=True):
+        """Queue ``cmd`` and return the future of its result.
+
+        ``ack`` is the key the decoder resolves when the scale confirms the
+        command (see NotificationDecoder.pending), or None. ``resend=False``
+        skips the firmware v1.0 duplicate write.
+        """
+        if coalesce is not None:
+            command = self.queued.get(coalesce)
+            if command is not None:
+                command.cmd = cmd
+                command.ack = ack
+                command.resend = resend
+                if priority < command.priority:
+                    command.priority = priority
+                    heapq.heapify(self.queue)
+                return command.future
+
+        future = asyncio.get_event_loop().create_future()
+        command = _Command(priority, next(self._seq), cmd, ack, coalesce, resend, future)
+        heapq.heappush(self.queue, command)
+        if coalesce is not None:
+            self.queued[coalesce] = command
+        self._start()
+        return future
+
+    def clear(self):
+        """Complete every queued and unacknowledged command with False (link lost)"""
+        commands = self.queue + list(self.in_flight.values())
+        if self.writing is not None:
+            commands.append(self.writing)
+        self.queue = []
+        self.queued.clear()
+        for command in commands:
+            self._release(command)
+            if not command.future.done():
+                command.future.set_result(False)
+
+    def _start(self):
+        if self.writer_task is None and self.queue:
+            self.writer_task = asyncio.ensure_future(self._run())
+
+    def _next(self):
+        """Pop the first command whose acknowledgement key is not in flight"""
+        queue = self.queue
+        blocked = []
+        command = None
+        while queue:
+            candidate = heapq.heappop(queue)
+            if candidate.future.done():
+                # Cancelled by its caller before it was written
+                continue
+            if candidate.ack is not None and candidate.ack in self.in_flight:
+                blocked.append(candidate)
+            else:
+                command = candidate
+                break
+        for candidate in blocked:
+            heapq.heappush(queue, candidate)
+        if command is not None and self.queued.get(command.coalesce) is command:
+            del self.queued[command.coalesce]
+        return command
+
+    async def _run(self):
+        try:
+            while True:
+                command = self._next()
+                if command is None:
+                    return
+                self.writing = command
+                try:
+                    await self._write(command)
+                finally:
+                    self.writing = None
+        finally:
+            self.writer_task = None
+
+    async def _write(self, command):
+        scale = self.scale
+        metrics = scale.metrics
+        loop = asyncio.get_event_loop()
+        if metrics is not None and not command.attempts:
+            metrics.commands += 1
+        command.attempts += 1
+        acknowledged = (command.ack is not None and scale.notifying
+                        and getattr(scale.client, 'acknowledges', True))
+        if acknowledged:
+            # Registered before writing: the acknowledgement can arrive at once
+            command.ack_future = scale.notification_handler.pending[command.ack] = _Acknowledgement(self, command)
+            self.in_flight[command.ack] = command
+        try:
+            command.start = loop.time()
+            await self.write(command.cmd, command.resend)
+        except Exception as e:
+            self._release(command)
+            if not command.future.done():
+                command.future.set_exception(e)
+            return
+        if command.future.done():
+            # Acknowledged or cleared while writing
+            self._release(command)
+        elif not acknowledged:
+            command.future.set_result(True)
+        else:
+            command.timer = loop.call_later(scale.ack_timeout, self._timed_out, command)
+
+    def _release(self, command):
+        """Stop waiting for the acknowledgement of ``command``"""
+        if command.timer is not None:
+            command.timer.cancel()
+            command.timer = None
+        ack_future, command.ack_future = command.ack_future, None
+        if ack_future is not None:
+            pending = self.scale.notification_handler.pending
+            if pending.get(command.ack) is ack_future:
+                del pending[command.ack]
+            if self.in_flight.get(command.ack) is command:
+                del self.in_flight[command.ack]
+
+    def _acknowledged(self, command, ack_future):
+        if ack_future is not command.ack_future:
+            return
+        self._release(command)
+        metrics = self.scale.metrics
+        if metrics is not None:
+            metrics.acks += 1
+            metrics.command_rtt_ms.observe((asyncio.get_event_loop().time() - command.start) * 1e3)
+        if not command.future.done():
+            command.future.set_result(True)
+        self._start()
+
+    def _timed_out(self, command):
+        command.timer = None
+        self._release(command)
+        scale = self.scale
+        metrics = scale.metrics
+        if metrics is not None:
+            metrics.ack_timeouts += 1
+        if command.future.done():
+            pass
+        elif command.attempts <= scale.command_retries:
+            logger.debug("No acknowledgement for %s (attempt %d)", command.cmd.hex(), command.attempts)
+            # Keeps its place: same priority and sequence number
+            heapq.heappush(self.queue, command)
+        else:
+            logger.warning("Command %s was not acknowledged by the scale", command.cmd.hex())
+            if metrics is not None:
+                metrics.unacknowledged += 1
+            command.future.set_result(False)
+        self._start()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Command frames of the Decent Scale protocol.
+
+A command is 7 bytes: ``03 <type> <4 payload bytes> <xor>``, where the last
+byte is the XOR of the first six. Every command the library sends is built
+once here, as immutable bytes shared by all scales, so sending one does no
+encoding and creates no objects:
+
+    TARE[heartbeat][counter]   tare with a counter (0-255) and heartbeat flag (0/1)
+    LED_ON_GRAMS, LED_ON_OUNCES, LED_OFF, POWER_OFF,
+    START_TIMER, STOP_TIMER, RESET_TIMER, HEARTBEAT
+
+``encode()`` builds any other command, caching the frames it returns.
+"""
+
+LED = 0x0A
+TIMER = 0x0B
+TARE_TYPE = 0x0F
+
+
+def checksum(data):
+    """XOR of the first six bytes of a command"""
+    return data[0] ^ data[1] ^ data[2] ^ data[3] ^ data[4] ^ data[5]
+
+
+def _frame(type_, p0, p1, p2, p3):
+    return bytes((0x03, type_, p0, p1, p2, p3, 0x03 ^ type_ ^ p0 ^ p1 ^ p2 ^ p3))
+
+
+# Frames built by encode(), by (type, payload). Bounded like the weight
+# packet cache in transport.py.
+_frames = {}
+
+
+def encode(cmd_type, payload=b'\x00\x00\x00\x00'):
+    """The 7-byte frame (immutable, shared) for ``cmd_type`` and a 4-byte ``payload``"""
+    key = (cmd_type, bytes(payload))
+    frame = _frames.get(key)
+    if frame is None:
+        if len(key[1]) != 4:
+            raise ValueError("A command payload is 4 bytes, got %d" % len(key[1]))
+        frame = _frame(cmd_type, *key[1])
+        if len(_frames) > 0x1000:
+            _frames.clear()
+        _frames[key] = frame
+    return frame
+
+
+# Tare: 03 0F <counter> 00 00 <heartbeat> <xor>; the scale echoes the counter
+TARE = (
+    tuple(_frame(TARE_TYPE, counter, 0x00, 0x00, 0x00) for counter in range(256)),
+    tuple(_frame(TARE_TYPE, counter, 0x00, 0x00, 0x01) for counter in range(256)),
+)
+
+LED_ON_GRAMS = encode(LED, b'\x01\x01\x00\x00')
+LED_ON_OUNCES = encode(LED, b'\x01\x01\x01\x00')
+LED_OFF = encode(LED, b'\x00\x00\x00\x00')
+POWER_OFF = encode(LED, b'\x02\x00\x00\x00')
+START_TIMER = encode(TIMER, b'\x03\x00\x00\x00')
+STOP_TIMER = encode(TIMER, b'\x00\x00\x00\x00')
+RESET_TIMER = encode(TIMER, b'\x02\x00\x00\x00')
+# Half Decent Scale keepalive, required at least every 5 seconds
+HEARTBEAT = encode(LED, b'\x03\xff\xff\x00')
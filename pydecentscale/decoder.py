@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Table-driven decoder for Decent Scale notifications.
+
+The decoder runs on the event loop thread for every packet the scale sends
+(10 Hz per scale), so the hot path avoids slicing, ``functools.reduce`` and
+building log strings unless debug logging is enabled.
+"""
+
+import binascii
+import logging
+import sys
+import time
+
+from .metrics import OK, INVALID, XOR_FAILED, UNKNOWN_TYPE
+from .stream import WeightSample
+
+logger = logging.getLogger(__name__)
+
+# Firmware version reported in byte 5 of the 0x0A (LED) response
+FIRMWARE_VERSIONS = {0xFE: '1.0', 0x02: '1.1', 0x03: '1.2'}
+
+if sys.version_info >= (3, 8):
+    def _hexlify(data):
+        return binascii.hexlify(data, sep=':')
+else:
+    def _hexlify(data):
+        return binascii.hexlify(data)
+
+
+def _xor_ok_7(d):
+    """Check the XOR byte of a 7-byte message without slicing it."""
+    return d[0] ^ d[1] ^ d[2] ^ d[3] ^ d[4] ^ d[5] == d[6]
+
+
+def _xor_ok_10(d):
+    """Check the XOR byte of a 10-byte message (firmware v1.2+) without slicing it."""
+    return d[0] ^ d[1] ^ d[2] ^ d[3] ^ d[4] ^ d[5] ^ d[6] ^ d[7] ^ d[8] == d[9]
+
+
+# Valid message lengths mapped to their checksum function. A single dict
+# lookup validates the length and selects the check.
+XOR_CHECKS = {7: _xor_ok_7, 10: _xor_ok_10}
+
+
+class NotificationDecoder(object):
+    """Decode notifications and store the results on a scale object.
+
+    The instance is callable with the ``(sender, data)`` signature expected by
+    ``BleakClient.start_notify``. Decoded values are written to the attributes
+    of ``scale`` (``weight``, ``sample``, ``battery_level``, ...).
+
+    ``pending`` maps acknowledgement keys to futures waiting for them: a tare
+    response resolves ``(0x0F, counter)`` and an LED response resolves
+    ``0x0A``. The future result is the acknowledging packet; anything with
+    ``done()`` and ``set_result()`` can stand in for the future.
+
+    ``listeners`` are called with the new WeightSample after every weight
+    packet. The list is replaced rather than mutated when subscribers
+    change, so it can be updated from another thread while packets are
+    being decoded.
+
+    ``recorder``, if set, receives every raw packet once it is decoded, with
+    the decode status and raw weight (see pydecentscale.recorder).
+    ``metrics``, if set, is a ScaleMetrics that records decode times, packet
+    inter-arrival times and rejected packets. ``clock`` returns the host
+    time in ns stamped on samples and records; replays substitute the
+    recorded time.
+    """
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.pending = {}
+        self.listeners = []
+        self.recorder = None
+        self.metrics = None
+        self.clock = time.monotonic_ns
+        self.handlers = {
+            0xCA: self._weight,
+            0xCE: self._weight,
+            0xAA: self._button,
+            0x0F: self._tare,
+            0x0A: self._led,
+            0x0B: self._timer,
+        }
+
+    def __call__(self, sender, data):
+        if self.metrics is None:
+            self._decode(data)
+        else:
+            start = time.perf_counter_ns()
+            status = self._decode(data)
+            self.metrics.notification(status, data, start, time.perf_counter_ns())
+
+    def _decode(self, data):
+        status = self._dispatch(data)
+        if self.recorder is not None:
+            self._record(data, status)
+        return status
+
+    def _dispatch(self, data):
+        check = XOR_CHECKS.get(len(data))
+        if check is None or data[0] != 0x03:
+            # Basic sanity check - support both 7 and 10 byte messages
+            logger.info("Invalid notification: not a Decent Scale?")
+            return INVALID
+
+        if not check(data):
+            logger.warning("XOR verification failed for notification")
+            return XOR_FAILED
+
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("Received Notification at %s: %s", time.time(), _hexlify(data))
+
+        handler = self.handlers.get(data[1])
+        if handler is None:
+            logger.warning("Unknown Notification Type received: 0x%02x", data[1])
+            return UNKNOWN_TYPE
+        handler(data, debug)
+        return OK
+
+    def _record(self, data, status):
+        if status == OK and (data[1] == 0xCA or data[1] == 0xCE):
+            # Stamped and decoded by _weight
+            sample = self.scale.sample
+            self.recorder.record(data, sample.host_ns, status, sample.raw)
+        else:
+            self.recorder.record(data, self.clock(), status)
+
+    def _weight(self, data, debug):
+        raw = data[2] << 8 | data[3]
+        if raw & 0x8000:
+            raw -= 0x10000
+        weight = raw / 10
+
+        # 10-byte messages (firmware v1.2+) carry minutes, seconds, deciseconds
+        device_time = None
+        if len(data) == 10:
+            device_time = data[4] * 600 + data[5] * 10 + data[6]
+            if debug:
+                logger.debug("Weight: %sg at %d:%02d.%d", weight, data[4], data[5], data[6])
+
+        sample = WeightSample(self.clock(), weight, raw, device_time)
+        scale = self.scale
+        scale.sample = sample
+        scale.weight = weight
+
+        for listener in self.listeners:
+            listener(sample)
+
+    def _button(self, data, debug):
+        if debug:
+            logger.debug("Button press: %d, duration: %d", data[2], data[3])
+
+    def _resolve(self, key, data):
+        future = self.pending.get(key)
+        if future is not None and not future.done():
+            future.set_result(data)
+
+    def _tare(self, data, debug):
+        if debug and data[5] == 0xFE:
+            logger.debug("Tare command confirmed")
+        if self.pending:
+            self._resolve((0x0F, data[2]), data)
+
+    def _led(self, data, debug):
+        # LED on/off response -> returns units, battery level, and firmware version
+        scale = self.scale
+        scale.weight_unit = 'oz' if data[3] == 0x01 else 'g'
+        scale.battery_level = data[4] if data[4] != 0xFF else 'USB'
+        scale.firmware_version = FIRMWARE_VERSIONS.get(data[5], 'Unknown (%02x)' % data[5])
+        if debug:
+            logger.debug("Scale info - Unit: %s, Battery: %s%%, Firmware: %s",
+                         scale.weight_unit, scale.battery_level, scale.firmware_version)
+        if self.pending:
+            self._resolve(0x0A, data)
+
+    def _timer(self, data, debug):
+        # Timer info
+        pass
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Prometheus text-format exporter for a fleet of scales.
+
+    from pydecentscale.exporter import MetricsExporter
+
+    exporter = MetricsExporter(manager)   # a ScaleManager, AsyncScaleManager or scales
+    exporter.serve(9100)                  # http://localhost:9100/metrics
+
+Every series is labelled with the scale address. The label strings, series
+prefixes and histogram bucket bounds of each scale are built once when the
+scale is added, so a scrape only reads a few attributes per scale and joins
+preallocated strings. A rendered page is reused for ``min_interval``
+seconds, so any number of scrapers cost at most one render per interval.
+Command latency and sample rate require metrics (``metrics=True``) on the
+scales; the other series are always exported.
+"""
+
+import http.server
+import threading
+import time
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+PREFIX = 'decentscale_'
+
+# (name, type, help); the order in which families are rendered
+FAMILIES = (
+    ('up', 'gauge', 'Whether the scale is connected'),
+    ('weight_grams', 'gauge', 'Last weight reported by the scale'),
+    ('battery_percent', 'gauge', 'Battery level (NaN when USB powered or unknown)'),
+    ('usb_powered', 'gauge', 'Whether the scale reports USB power'),
+    ('firmware_info', 'gauge', 'Firmware version of the scale'),
+    ('flow_rate_grams_per_second', 'gauge', 'Flow rate over the flow window'),
+    ('sample_rate_hertz', 'gauge', 'Weight packet rate over the last 5 s'),
+    ('notifications_total', 'counter', 'Packets received'),
+    ('weights_total', 'counter', 'Valid weight packets received'),
+    ('xor_failures_total', 'counter', 'Packets rejected by the XOR check'),
+    ('unknown_types_total', 'counter', 'Packets of an unknown type'),
+    ('ack_timeouts_total', 'counter', 'Command acknowledgements that timed out'),
+    ('unacknowledged_total', 'counter', 'Commands never acknowledged'),
+    ('link_dropped_total', 'counter', 'Packets dropped by the link (USB queue or WiFi coalescing)'),
+    ('disconnects_total', 'counter', 'Unexpected link drops'),
+    ('reconnects_total', 'counter', 'Automatic reconnects'),
+    ('command_rtt_seconds', 'histogram', 'Command round trip to acknowledgement'),
+)
+
+NAN = 'NaN'
+
+
+def _number(value):
+    if value is None:
+        return NAN
+    return repr(float(value))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Series(object):
+    """Preallocated series prefixes of one scale"""
+
+    def __init__(self, scale, address):
+        self.scale = scale
+        self.address = address
+        labels = 'address="%s"' % _escape(address)
+        self.labels = labels
+        self.prefix = {name: '%s%s{%s} ' % (PREFIX, name, labels) for name, _, _ in FAMILIES}
+        self.firmware = None
+        self.firmware_line = None
+        self.buckets = None
+        self.bucket_prefixes = ()
+
+    def firmware_info(self, version):
+        # Rebuilt only when the reported version changes
+        if version != self.firmware:
+            self.firmware = version
+            self.firmware_line = '%sfirmware_info{%s,version="%s"} 1\n' % (PREFIX, self.labels, _escape(version))
+        return self.firmware_line
+
+    def histogram_prefixes(self, bounds):
+        if bounds is not self.buckets:
+            self.buckets = bounds
+            name = PREFIX + 'command_rtt_seconds'
+            self.bucket_prefixes = tuple(
+                '%s_bucket{%s,le="%s"} ' % (name, self.labels, le)
+                for le in [repr(b / 1e3) for b in bounds] + ['+Inf'])
+            self.sum_prefix = '%s_sum{%s} ' % (name, self.labels)
+            self.count_prefix = '%s_count{%s} ' % (name, self.labels)
+        return self.bucket_prefixes
+
+
+class MetricsExporter(object):
+    """Render scale metrics in the Prometheus text format.
+
+    ``source`` is a ScaleManager or AsyncScaleManager (scales connected
+    later are picked up automatically), a dict of scales by address, or an
+    iterable of scales; more can be added with ``add()``.
+    """
+
+    def __init__(self, source=None, min_interval=1.0):
+        self.min_interval = min_interval
+        self.series = {}
+        self.source = None
+        self.server = None
+        self._page = b''
+        self._rendered_at = None
+        self._lock = threading.Lock()
+        if source is not None:
+            scales = getattr(source, 'scales', source)
+            if isinstance(scales, dict):
+                self.source = scales
+            else:
+                for scale in scales:
+                    self.add(scale)
+
+    def add(self, scale, address=None):
+        address = address or getattr(scale, 'address', None)
+        if address is None:
+            raise ValueError("The scale has no address yet; connect it or pass address=")
+        self.series[address] = _Series(scale, address)
+
+    def remove(self, address):
+        self.series.pop(address, None)
+
+    def _sync(self):
+        source = self.source
+        if source is not None and len(source) != len(self.series):
+            for address, scale in list(source.items()):
+                if address not in self.series:
+                    self.add(scale, address)
+
+    def render(self):
+        """The exposition page as bytes; reused for ``min_interval`` seconds"""
+        with self._lock:
+            now = time.monotonic()
+            if self._rendered_at is None or now - self._rendered_at >= self.min_interval:
+                self._sync()
+                self._page = self._render().encode('utf-8')
+                self._rendered_at = now
+            return self._page
+
+    def _render(self):
+        series = list(self.series.values())
+        values = [self._values(s) for s in series]
+        out = []
+        append = out.append
+        for index, (name, type_, help_) in enumerate(FAMILIES):
+            append('# HELP %s%s %s\n# TYPE %s%s %s\n' % (PREFIX, name, help_, PREFIX, name, type_))
+            if name == 'firmware_info':
+                for s, v in zip(series, values):
+                    if v[index] is not None:
+                        append(s.firmware_info(v[index]))
+            elif name == 'command_rtt_seconds':
+                for s, v in zip(series, values):
+                    histogram = v[index]
+                    if histogram is not None:
+                        self._histogram(s, histogram, append)
+            else:
+                for s, v in zip(series, values):
+                    if v[index] is not None:
+                        append(s.prefix[name])
+                        append(v[index])
+                        append('\n')
+        return ''.join(out)
+
+    @staticmethod
+    def _histogram(series, histogram, append):
+        prefixes = series.histogram_prefixes(histogram.bounds)
+        cumulative = 0
+        for prefix, count in zip(prefixes, histogram.counts):
+            cumulative += count
+            append(prefix)
+            append(str(cumulative))
+            append('\n')
+        append(series.sum_prefix)
+        append(repr(histogram.total / 1e3))
+        append('\n')
+        append(series.count_prefix)
+        append(str(histogram.count))
+        append('\n')
+
+    @staticmethod
+    def _values(series):
+        """One value per family (formatted, or None to omit), read from the scale"""
+        scale = series.scale
+        metrics = scale.metrics
+        client = scale.client
+        battery = scale.battery_level
+        usb = battery == 'USB'
+        dropped = getattr(client, 'dropped', None)
+        if dropped is None:
+            dropped = getattr(client, 'coalesced', None)
+        return (
+            '1' if scale.connected else '0',
+            _number(scale.weight),
+            NAN if usb or battery is None else _number(battery),
+            '1' if usb else '0',
+            scale.firmware_version,
+            _number(scale.flow_rate),
+            None if metrics is None else _number(metrics.sample_rate),
+            None if metrics is None else str(metrics.notifications),
+            None if metrics is None else str(metrics.weights),
+            None if metrics is None else str(metrics.xor_failures),
+            None if metrics is None else str(metrics.unknown_types),
+            None if metrics is None else str(metrics.ack_timeouts),
+            None if metrics is None else str(metrics.unacknowledged),
+            None if dropped is None else str(dropped),
+            None if metrics is None else str(metrics.disconnects),
+            None if metrics is None else str(metrics.reconnects),
+            None if metrics is None else metrics.command_rtt_ms,
+        )
+
+    def serve(self, port=9100, host=''):
+        """Serve ``/metrics`` over HTTP from a daemon thread. Returns the server."""
+        exporter = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                page = exporter.render()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(page)))
+                self.end_headers()
+                self.wfile.write(page)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        thread = threading.Thread(target=self.server.serve_forever, name='DecentScaleMetrics', daemon=True)
+        thread.start()
+        return self.server
+
+    def shutdown(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
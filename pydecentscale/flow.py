@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Streaming flow-rate estimation from weight samples.
+
+The flow rate is the least-squares slope of weight over time in a sliding
+window. Running sums are updated in O(1) per sample, so the estimator can
+be fed directly from the notification handler.
+"""
+
+from collections import deque
+
+# Seconds after which times are re-expressed relative to the window start,
+# so that adding and subtracting large squares does not lose precision
+REBASE_AFTER = 60.0
+
+
+class _Sums(object):
+    """Running sums for a least-squares fit of y on x"""
+
+    __slots__ = ('n', 'x', 'y', 'xx', 'xy')
+
+    def __init__(self):
+        self.n = 0
+        self.x = self.y = self.xx = self.xy = 0.0
+
+    def add(self, x, y, sign=1):
+        self.n += sign
+        self.x += sign * x
+        self.y += sign * y
+        self.xx += sign * x * x
+        self.xy += sign * x * y
+
+    def slope(self):
+        if self.n < 2:
+            return None
+        denominator = self.n * self.xx - self.x * self.x
+        # Less than ~1 ms of spread: all samples share one time stamp
+        if denominator <= 1e-6 * self.n * self.n:
+            return None
+        return (self.n * self.xy - self.x * self.y) / denominator
+
+
+class FlowEstimator(object):
+    """Sliding-window least-squares flow rate in g/s.
+
+    ``window`` is the window length in seconds of host time. The slope is
+    computed against the scale's own timer (firmware v1.2+) when every
+    sample in the window carries one, and against the host monotonic clock
+    otherwise. A scale timer that goes backwards (e.g. reset_time()) resets
+    the window.
+
+    Call ``update`` with each WeightSample and read ``flow_rate``; the slope
+    itself is only computed when ``flow_rate`` is read.
+    """
+
+    def __init__(self, window=1.0):
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self._samples = deque()
+        self._host = _Sums()
+        self._device = _Sums()
+        self._origin_ns = None
+        self._origin_device = None
+        self._last_device = None
+
+    def update(self, sample):
+        device_time = sample.device_time
+        if device_time is not None:
+            if self._last_device is not None and device_time < self._last_device:
+                self.reset()
+            if self._origin_device is None:
+                self._origin_device = device_time
+            self._last_device = device_time
+
+        # Times relative to an origin near the window keep the sums small
+        if self._origin_ns is None:
+            self._origin_ns = sample.host_ns
+        host_t = (sample.host_ns - self._origin_ns) * 1e-9
+        self._evict(host_t - self.window)
+        if host_t > REBASE_AFTER:
+            self._rebase(host_t)
+            host_t = (sample.host_ns - self._origin_ns) * 1e-9
+
+        device_t = None if device_time is None else (device_time - self._origin_device) * 0.1
+        weight = sample.weight
+        self._samples.append((host_t, device_t, weight))
+        self._host.add(host_t, weight)
+        if device_t is not None:
+            self._device.add(device_t, weight)
+
+    def _evict(self, oldest):
+        samples = self._samples
+        while samples and samples[0][0] < oldest:
+            host_t, device_t, weight = samples.popleft()
+            self._host.add(host_t, weight, -1)
+            if device_t is not None:
+                self._device.add(device_t, weight, -1)
+
+    def _rebase(self, host_t):
+        """Move the time origin to the oldest sample in the window and rebuild
+        the sums. Runs once every REBASE_AFTER seconds, so updates stay O(1)
+        amortized."""
+        samples = self._samples
+        host_shift = samples[0][0] if samples else host_t
+        device_shift = next((d for _, d, _ in samples if d is not None), None)
+        self._origin_ns += int(host_shift * 1e9)
+        if device_shift is not None:
+            self._origin_device += int(round(device_shift * 10))
+        self._samples = deque()
+        self._host = _Sums()
+        self._device = _Sums()
+        for old_host_t, device_t, weight in samples:
+            old_host_t -= host_shift
+            if device_t is not None:
+                device_t -= device_shift
+                self._device.add(device_t, weight)
+            self._samples.append((old_host_t, device_t, weight))
+            self._host.add(old_host_t, weight)
+
+    @property
+    def flow_rate(self):
+        """Flow rate in g/s over the current window, or None with too few samples"""
+        if self._device.n == self._host.n:
+            rate = self._device.slope()
+            if rate is not None:
+                return rate
+        return self._host.slope()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Manage several Decent Scales on one event loop.
+
+A single BLE scan discovers every advertising Decent Scale, and the scales
+are then connected concurrently instead of one scan and one connection at a
+time per scale.
+"""
+
+import asyncio
+import logging
+
+from bleak import BleakScanner
+
+from .async_scale import AsyncDecentScale, DEVICE_NAME
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncScaleManager(object):
+    """Discover and connect all nearby Decent Scales on the running loop.
+
+    Connected scales are available by address, e.g. ``manager['AA:BB:...']``.
+    ``scale_kwargs`` are passed to every AsyncDecentScale that is created.
+    """
+
+    def __init__(self, timeout=20, scanner=None, **scale_kwargs):
+        self.timeout = timeout
+        self.scanner = scanner or BleakScanner
+        self.scale_kwargs = dict(scale_kwargs, scanner=self.scanner)
+        self.devices = {}
+        self.scales = {}
+
+    def __getitem__(self, address):
+        return self.scales[address]
+
+    def __iter__(self):
+        return iter(self.scales.values())
+
+    def __len__(self):
+        return len(self.scales)
+
+    async def discover(self, scan_time=5.0, expected=None):
+        """Scan once for ``scan_time`` seconds and return every Decent Scale found.
+        The scan stops early once ``expected`` scales have been seen."""
+        found = {}
+        done = asyncio.Event()
+
+        def detected(device, advertisement_data):
+            if device.name == DEVICE_NAME and device.address not in found:
+                logger.info('Found Decent Scale: %s', device.address)
+                found[device.address] = device
+                if expected and len(found) >= expected:
+                    done.set()
+
+        async with self.scanner(detected):
+            try:
+                await asyncio.wait_for(done.wait(), scan_time)
+            except asyncio.TimeoutError:
+                pass
+
+        self.devices.update(found)
+        return list(found.values())
+
+    def add(self, address):
+        """Return the scale for ``address``, creating it if needed"""
+        scale = self.scales.get(address)
+        if scale is None:
+            scale = self.scales[address] = AsyncDecentScale(timeout=self.timeout, **self.scale_kwargs)
+        return scale
+
+    async def connect_all(self, devices=None):
+        """Connect concurrently to ``devices`` (default: every discovered scale).
+        Returns a dict mapping each address to whether it connected."""
+        if devices is None:
+            devices = list(self.devices.values())
+        addresses = [getattr(d, 'address', d) for d in devices]
+        # Connecting with the BLEDevice from the scan avoids a second scan per scale
+        results = await asyncio.gather(*[self.add(address).connect(device)
+                                         for address, device in zip(addresses, devices)])
+        for address, connected in zip(addresses, results):
+            if not connected:
+                logger.warning('Could not connect to %s', address)
+        return dict(zip(addresses, results))
+
+    async def auto_connect(self, scan_time=5.0, expected=None):
+        """Discover all scales with a single scan and connect to them"""
+        await self.discover(scan_time, expected)
+        return await self.connect_all()
+
+    async def disconnect_all(self):
+        await asyncio.gather(*[scale.disconnect() for scale in self.scales.values() if scale.connected])
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Counters and latency histograms for one scale.
+
+Metrics are off by default; the decoder and command path only check for a
+metrics object. Enable them with ``AsyncDecentScale(metrics=True)`` (or
+``DecentScale(metrics=True)``) and read ``scale.metrics.snapshot()``:
+
+    {'counters': {'notifications': 1203, 'xor_failures': 2, ...},
+     'sample_rate': 9.97,
+     'histograms': {'interarrival_ms': {'count': ..., 'mean': ..., 'p50': ...,
+                                        'p99': ..., 'buckets': [...]}, ...}}
+
+Histograms have fixed buckets, so recording a value is a bisect and a few
+additions, and memory does not grow with the number of samples.
+"""
+
+import bisect
+import json
+import time
+from collections import deque
+
+# Upper bounds of the histogram buckets; the last bucket is unbounded
+MS_BUCKETS = (1, 2, 5, 10, 20, 50, 75, 100, 125, 150, 200, 300, 500, 1000, 2000, 5000)
+US_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 10000)
+
+# sample_rate covers the weight packets of the last RATE_WINDOW seconds, at
+# most MAX_ARRIVALS of them
+RATE_WINDOW = 5.0
+MAX_ARRIVALS = 1024
+
+COUNTERS = (
+    'notifications',   # every packet received
+    'weights',         # valid weight packets
+    'invalid',         # wrong length or header
+    'xor_failures',    # failed checksum
+    'unknown_types',   # valid packet of an unknown type
+    'commands',        # commands sent
+    'acks',            # commands acknowledged by the scale
+    'ack_timeouts',    # acknowledgement waits that timed out (each retry counts)
+    'unacknowledged',  # commands given up on after all retries
+    'disconnects',     # unexpected link drops
+    'reconnects',      # successful automatic reconnects
+)
+
+# Decode results reported by NotificationDecoder._decode
+OK = 0
+INVALID = 1
+XOR_FAILED = 2
+UNKNOWN_TYPE = 3
+
+
+class Histogram(object):
+    """Fixed-bucket histogram. ``counts[i]`` counts values <= ``bounds[i]``
+    (and above the previous bound); the last count is for larger values."""
+
+    __slots__ = ('bounds', 'counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the ``q`` quantile (the maximum
+        for the last bucket), or None when empty"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'buckets': [[bound, count] for bound, count in zip(self.bounds + ('+Inf',), self.counts)],
+        }
+
+
+class ScaleMetrics(object):
+    """Counters and histograms of one scale.
+
+    Histograms:
+
+    - ``interarrival_ms``: time between consecutive weight packets
+    - ``decode_us``: time spent decoding a packet, listeners included
+    - ``write_ms``: duration of each write to the link
+    - ``command_rtt_ms``: from writing a command to its acknowledgement
+    - ``sync_call_ms``: how long DecentScale (blocking API) calls waited
+    """
+
+    def __init__(self):
+        self.interarrival_ms = Histogram(MS_BUCKETS)
+        self.arrivals = deque(maxlen=MAX_ARRIVALS)
+        self.decode_us = Histogram(US_BUCKETS)
+        self.write_ms = Histogram(MS_BUCKETS)
+        self.command_rtt_ms = Histogram(MS_BUCKETS)
+        self.sync_call_ms = Histogram(MS_BUCKETS)
+        self.reset()
+
+    def reset(self):
+        for name in COUNTERS:
+            setattr(self, name, 0)
+        for histogram in self.histograms().values():
+            histogram.reset()
+        self.started_ns = time.monotonic_ns()
+        self.last_weight_ns = None
+        self.arrivals.clear()
+
+    def histograms(self):
+        return {
+            'interarrival_ms': self.interarrival_ms,
+            'decode_us': self.decode_us,
+            'write_ms': self.write_ms,
+            'command_rtt_ms': self.command_rtt_ms,
+            'sync_call_ms': self.sync_call_ms,
+        }
+
+    def notification(self, status, data, start_ns, end_ns):
+        """Record one decoded packet (called by NotificationDecoder), with the
+        time.perf_counter_ns() before and after decoding it"""
+        self.notifications += 1
+        self.decode_us.observe((end_ns - start_ns) / 1e3)
+        if status == OK:
+            if data[1] == 0xCE or data[1] == 0xCA:
+                self.weights += 1
+                if self.last_weight_ns is not None:
+                    self.interarrival_ms.observe((start_ns - self.last_weight_ns) / 1e6)
+                self.last_weight_ns = start_ns
+                self.arrivals.append(start_ns)
+        elif status == XOR_FAILED:
+            self.xor_failures += 1
+        elif status == UNKNOWN_TYPE:
+            self.unknown_types += 1
+        else:
+            self.invalid += 1
+
+    @property
+    def sample_rate(self):
+        """Weight packets per second over the last RATE_WINDOW seconds, from
+        their mean inter-arrival time; None with fewer than two packets in
+        the window, e.g. once the scale stops sending"""
+        arrivals = self.arrivals
+        cutoff = time.perf_counter_ns() - int(RATE_WINDOW * 1e9)
+        while arrivals and arrivals[0] < cutoff:
+            arrivals.popleft()
+        if len(arrivals) < 2 or arrivals[-1] == arrivals[0]:
+            return None
+        return (len(arrivals) - 1) / ((arrivals[-1] - arrivals[0]) / 1e9)
+
+    def snapshot(self):
+        """All counters and histogram summaries as a dict of plain values"""
+        return {
+            'uptime': (time.monotonic_ns() - self.started_ns) / 1e9,
+            'counters': {name: getattr(self, name) for name in COUNTERS},
+            'sample_rate': self.sample_rate,
+            'histograms': {name: h.snapshot() for name, h in self.histograms().items()},
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.snapshot(), **kwargs)
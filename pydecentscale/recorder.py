@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Binary session recorder and memory-mapped reader.
+
+Every notification received from a scale is appended to a file as a
+fixed-width 24-byte record:
+
+    offset  size  field
+    0       8     host_ns   int64, time.monotonic_ns() at arrival
+    8       1     length    uint8, packet length (7 or 10 for valid packets)
+    9       10    packet    raw packet bytes, zero padded
+    19      2     raw       int16, weight in grams x 10 (weight packets only)
+    21      1     flags     uint8, FLAG_XOR_OK | FLAG_WEIGHT
+    22      2     (padding)
+
+after a 16-byte file header. Writes go through a buffered file, and the
+reader memory-maps the file and exposes NumPy views of each column without
+copying. Reading requires NumPy.
+"""
+
+import mmap
+import os
+import struct
+import time
+
+from .decoder import XOR_CHECKS
+from .metrics import OK, UNKNOWN_TYPE
+
+MAGIC = b'PYDSREC1'
+HEADER = struct.Struct('<8sHH4x')
+RECORD = struct.Struct('<qB10shB2x')
+HEADER_SIZE = HEADER.size
+RECORD_SIZE = RECORD.size
+VERSION = 1
+
+FLAG_XOR_OK = 0x01
+FLAG_WEIGHT = 0x02
+
+MAX_PACKET = 10
+
+
+class SessionRecorder(object):
+    """Append every notification of a scale to a binary session file.
+
+        recorder = scale.record('shot.pyds')
+        ...
+        scale.stop_recording()
+
+    ``buffer_size`` is the size of the write buffer in bytes; records reach
+    the disk when it fills, on ``flush()`` and on ``close()``.
+    """
+
+    def __init__(self, path, buffer_size=64 * 1024):
+        self.path = path
+        self.count = 0
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if size:
+            _check_header(path)
+            # Drop a partially written last record so appends stay aligned
+            whole = HEADER_SIZE + (size - HEADER_SIZE) // RECORD_SIZE * RECORD_SIZE
+            if whole != size:
+                os.truncate(path, whole)
+        self._file = open(path, 'ab', buffering=buffer_size)
+        if not size:
+            self._file.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE))
+
+    def record(self, data, host_ns=None, status=None, raw=0):
+        """Append one raw notification packet.
+
+        ``status`` and ``raw`` are the NotificationDecoder's results for the
+        packet (a pydecentscale.metrics status and, for weight packets, the
+        signed weight in grams x 10); without ``status`` the packet is
+        checked here.
+        """
+        if host_ns is None:
+            host_ns = time.monotonic_ns()
+        if status is None:
+            status, raw = _check(data)
+        flags = 0
+        if status == OK or status == UNKNOWN_TYPE:
+            flags = FLAG_XOR_OK
+            if data[1] == 0xCA or data[1] == 0xCE:
+                flags |= FLAG_WEIGHT
+        self._file.write(RECORD.pack(host_ns, len(data), bytes(data[:MAX_PACKET]), raw, flags))
+        self.count += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _check(data):
+    """Status and raw weight of a packet not seen by a decoder"""
+    check = XOR_CHECKS.get(len(data))
+    if check is None or data[0] != 0x03 or not check(data):
+        return None, 0
+    raw = 0
+    if data[1] == 0xCA or data[1] == 0xCE:
+        raw = data[2] << 8 | data[3]
+        if raw & 0x8000:
+            raw -= 0x10000
+    return OK, raw
+
+
+def _check_header(path):
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE:
+        raise ValueError("%s is not a pydecentscale session file" % path)
+    magic, version, record_size = HEADER.unpack(header)
+    if magic != MAGIC or record_size != RECORD_SIZE:
+        raise ValueError("%s is not a pydecentscale session file" % path)
+    return version
+
+
+def record_dtype():
+    """NumPy dtype matching the on-disk record layout"""
+    import numpy as np
+    return np.dtype([
+        ('host_ns', '<i8'),
+        ('length', 'u1'),
+        ('packet', 'u1', (MAX_PACKET,)),
+        ('raw', '<i2'),
+        ('flags', 'u1'),
+        ('pad', 'V2'),
+    ])
+
+
+class SessionReader(object):
+    """Memory-mapped, zero-copy view of a session file.
+
+    ``records`` is a structured array over the mapped file; ``host_ns``,
+    ``raw``, ``length``, ``flags`` and ``packets`` are views of its columns.
+    A partially written last record (e.g. after a crash) is ignored.
+
+        with SessionReader('shot.pyds') as session:
+            valid = session.flags & FLAG_WEIGHT != 0
+            t = (session.host_ns[valid] - session.host_ns[0]) * 1e-9
+            w = session.raw[valid] / 10
+    """
+
+    def __init__(self, path):
+        import numpy as np
+
+        self.path = path
+        self.version = _check_header(path)
+        self._file = open(path, 'rb')
+        count = (os.path.getsize(path) - HEADER_SIZE) // RECORD_SIZE
+        if count:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.records = np.frombuffer(self._mmap, dtype=record_dtype(), count=count, offset=HEADER_SIZE)
+        else:
+            self._mmap = None
+            self.records = np.empty(0, dtype=record_dtype())
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def host_ns(self):
+        return self.records['host_ns']
+
+    @property
+    def raw(self):
+        return self.records['raw']
+
+    @property
+    def length(self):
+        return self.records['length']
+
+    @property
+    def flags(self):
+        return self.records['flags']
+
+    @property
+    def packets(self):
+        """(N, 10) uint8 view of the raw packets; use ``length`` to trim each row"""
+        return self.records['packet']
+
+    def weights(self):
+        """Weights in grams of the valid weight packets, with their host_ns (copies)"""
+        mask = (self.flags & FLAG_WEIGHT) != 0
+        return self.host_ns[mask], self.raw[mask] / 10
+
+    def iter_packets(self):
+        """Yield ``(host_ns, packet_bytes)`` for every record, e.g. for replay"""
+        for host_ns, length, packet in zip(self.host_ns.tolist(), self.length.tolist(), self.packets):
+            yield host_ns, packet[:length].tobytes()
+
+    def close(self):
+        # Drop the views before closing the map they point into
+        self.records = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Arrays obtained from this reader are still alive; the map is
+                # released when they are garbage collected
+                pass
+            self._mmap = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Replay recorded packets through AsyncDecentScale without Bluetooth.
+
+FakeBleakClient stands in for ``BleakClient``: it records every command
+written to it and answers tare and LED commands the way a scale does, so the
+acknowledgement path runs unchanged. ReplayClient additionally feeds a
+recorded packet log to the scale's real notification handler, in real time,
+at N times real time, or as fast as possible.
+
+    python -m pydecentscale.replay shot.pyds --speed 100
+"""
+
+import argparse
+import asyncio
+import functools
+import time
+
+from bleak.exc import BleakError
+
+from .async_scale import AsyncDecentScale
+
+
+def make_packet(type_, payload):
+    """Build a scale packet from a type byte and payload, appending the XOR byte"""
+    data = bytearray([0x03, type_])
+    data.extend(payload)
+    xor = 0
+    for b in data:
+        xor ^= b
+    data.append(xor)
+    return data
+
+
+def scale_response(cmd, firmware=0x03, battery=100):
+    """Return the packet a Decent Scale sends in reply to ``cmd``, or None"""
+    if cmd[1] == 0x0F:
+        # Tare: echoes the counter
+        return make_packet(0x0F, (cmd[2], 0x00, 0x00, 0xFE))
+    if cmd[1] == 0x0A and cmd[2] in (0x00, 0x01):
+        # LED on/off: reports unit, battery level and firmware version
+        return make_packet(0x0A, (cmd[2], cmd[4], battery, firmware))
+    return None
+
+
+class FakeBleakClient(object):
+    """In-memory replacement for ``BleakClient``.
+
+    Every written command is appended to ``writes``. ``responder(cmd)``
+    returns the packet to notify in reply (or None); by default tare and LED
+    commands are acknowledged like a firmware v1.2 scale would.
+    """
+
+    def __init__(self, address, disconnected_callback=None, responder=scale_response, **kwargs):
+        self.address = address
+        self.disconnected_callback = disconnected_callback
+        self.responder = responder
+        self.is_connected = False
+        self.writes = []
+        self._callback = None
+        self._char = None
+
+    async def connect(self, timeout=None, **kwargs):
+        self.is_connected = True
+        return True
+
+    async def disconnect(self):
+        if self.is_connected:
+            self.drop()
+        return True
+
+    def drop(self):
+        """Simulate the link being lost"""
+        self.is_connected = False
+        self._callback = None
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+
+    async def start_notify(self, char, callback, **kwargs):
+        self._char = char
+        self._callback = callback
+
+    async def stop_notify(self, char):
+        self._callback = None
+
+    async def write_gatt_char(self, char, data, response=None):
+        if not self.is_connected:
+            raise BleakError("Not connected")
+        self.writes.append(bytes(data))
+        if self.responder is not None:
+            reply = self.responder(data)
+            if reply is not None:
+                asyncio.get_event_loop().call_soon(self.notify, reply)
+
+    def notify(self, data):
+        """Deliver a packet to the registered notification callback"""
+        if self._callback is not None:
+            self._callback(self._char, data)
+
+
+class ReplayClient(FakeBleakClient):
+    """FakeBleakClient that plays back ``packets``, an iterable of
+    ``(host_ns, packet)`` pairs such as SessionReader.iter_packets().
+
+    During playback the decoder is stamped with the recorded host time, so
+    samples, flow rates and recordings match the original session at any
+    speed.
+    """
+
+    def __init__(self, address, disconnected_callback=None, packets=(), **kwargs):
+        super().__init__(address, disconnected_callback, **kwargs)
+        self.packets = packets
+        self.now_ns = 0
+
+    @classmethod
+    def factory(cls, packets, **kwargs):
+        """A client_factory for AsyncDecentScale that replays ``packets``"""
+        return functools.partial(cls, packets=packets, **kwargs)
+
+    def _clock(self):
+        return self.now_ns
+
+    async def play(self, speed=1.0):
+        """Play the packets back. ``speed`` is a multiple of real time; None or 0
+        plays as fast as possible. Returns the number of packets delivered."""
+        if self._callback is None:
+            raise RuntimeError("start_notify() has not been called")
+        handler = self._callback
+        clock = getattr(handler, 'clock', None)
+        if clock is not None:
+            handler.clock = self._clock
+
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        first_ns = None
+        count = 0
+        try:
+            for host_ns, data in self.packets:
+                if first_ns is None:
+                    first_ns = host_ns
+                delay = 0
+                if speed:
+                    delay = start + (host_ns - first_ns) * 1e-9 / speed - loop.time()
+                # Always yield so commands and their acknowledgements interleave
+                await asyncio.sleep(delay if delay > 0 else 0)
+                if self._callback is None:
+                    break
+                self.now_ns = host_ns
+                self._callback(self._char, data)
+                count += 1
+        finally:
+            if clock is not None:
+                handler.clock = clock
+        return count
+
+
+async def replay(packets, speed=None, **scale_kwargs):
+    """Connect a new AsyncDecentScale to a ReplayClient and play ``packets``.
+    Returns the scale and the number of packets delivered."""
+    scale = AsyncDecentScale(client_factory=ReplayClient.factory(packets), **scale_kwargs)
+    await scale.connect('replay')
+    count = await scale.client.play(speed)
+    return scale, count
+
+
+def main(argv=None):
+    from .recorder import SessionReader
+
+    parser = argparse.ArgumentParser(description="Replay a recorded session through AsyncDecentScale")
+    parser.add_argument('path', help="session file written by scale.record()")
+    parser.add_argument('--speed', type=float, default=0,
+                        help="multiple of real time (default: as fast as possible)")
+    args = parser.parse_args(argv)
+
+    with SessionReader(args.path) as session:
+        started = time.perf_counter()
+        scale, count = asyncio.run(replay(session.iter_packets(), args.speed))
+        elapsed = time.perf_counter() - started
+
+    print('Replayed %d packets in %.3f s (%.0f packets/s)' % (count, elapsed, count / elapsed if elapsed else 0))
+    print('Final weight: %s g, flow rate: %s g/s' % (scale.weight, scale.flow_rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""In-process Decent Scale simulator.
+
+SimulatedScale implements the scale side of the protocol: it streams 0xCE
+weight packets (7-byte, or 10-byte with timer on firmware v1.2+), answers
+LED commands with unit, battery and firmware, answers tare with the
+counter, runs the timer, powers off, and can enforce the Half Decent Scale
+heartbeat timeout. A SimulatedBus holds any number of virtual scales and
+provides drop-in replacements for BleakClient and BleakScanner:
+
+    bus = SimulatedBus()
+    bus.add_scale(weight_curve=ramp(start=3, flow=2.0, target=36), firmware='1.2')
+    scale = AsyncDecentScale(client_factory=bus.client_factory, scanner=bus.scanner)
+    await scale.auto_connect()
+"""
+
+import asyncio
+import logging
+import random
+
+from bleak.exc import BleakError
+
+from .decoder import FIRMWARE_VERSIONS
+from .replay import FakeBleakClient, make_packet
+
+logger = logging.getLogger(__name__)
+
+FIRMWARE_BYTES = {version: byte for byte, version in FIRMWARE_VERSIONS.items()}
+
+
+def ramp(start=3.0, flow=2.0, target=36.0, cup=0.0):
+    """Weight curve of a simple shot: ``cup`` grams until ``start`` seconds,
+    then ``flow`` g/s until ``target`` grams are in the cup."""
+    def curve(t):
+        if t < start:
+            return cup
+        return cup + min(flow * (t - start), target)
+    return curve
+
+
+def constant(weight=0.0):
+    return lambda t: weight
+
+
+class SimulatedDevice(object):
+    """Minimal stand-in for bleak's BLEDevice"""
+
+    def __init__(self, address, name):
+        self.address = address
+        self.name = name
+
+    def __repr__(self):
+        return '%s: %s' % (self.address, self.name)
+
+
+class SimulatedScale(object):
+    """The scale side of the Decent Scale protocol.
+
+    ``weight_curve(t)`` gives the gross weight in grams ``t`` seconds after
+    notifications start. Packets are sent ``rate`` times per second with
+    uniform ``jitter`` (seconds) on each interval, and each is lost with
+    probability ``packet_loss``. Replies to commands arrive after
+    ``response_delay`` seconds. With ``heartbeat_timeout`` set, the scale
+    disconnects when no command arrives within that many seconds.
+    """
+
+    def __init__(self, address, name='Decent Scale', firmware='1.2', battery=100,
+                 weight_curve=None, rate=10.0, jitter=0.0, packet_loss=0.0,
+                 response_delay=0.0, heartbeat_timeout=None, seed=None):
+        self.device = SimulatedDevice(address, name)
+        self.firmware = firmware
+        self.battery = battery
+        self.weight_curve = weight_curve or constant()
+        self.rate = rate
+        self.jitter = jitter
+        self.packet_loss = packet_loss
+        self.response_delay = response_delay
+        self.heartbeat_timeout = heartbeat_timeout
+        self.random = random.Random(seed)
+
+        self.client = None
+        self.led_on = True
+        self.unit = 0x00
+        self.tare_offset = 0.0
+        self.tare_counter = None
+        self.timer_started = None  # loop time when the timer was (re)started
+        self.timer_elapsed = 0.0
+        self.packets_sent = 0
+        self.packets_lost = 0
+        self.commands = []
+        self._start = None
+        self._last_command = None
+        self._task = None
+
+    @property
+    def address(self):
+        return self.device.address
+
+    def gross_weight(self, now):
+        return self.weight_curve(now - self._start)
+
+    def timer(self, now):
+        if self.timer_started is None:
+            return self.timer_elapsed
+        return self.timer_elapsed + now - self.timer_started
+
+    def weight_packet(self, now):
+        raw = int(round((self.gross_weight(now) - self.tare_offset) * 10))
+        raw = max(-0x8000, min(0x7FFF, raw)) & 0xFFFF
+        if FIRMWARE_BYTES.get(self.firmware, 0x03) != 0x03:
+            return make_packet(0xCE, (raw >> 8, raw & 0xFF, 0x00, 0x00))
+        deciseconds = int(self.timer(now) * 10)
+        minutes, rest = divmod(deciseconds, 600)
+        seconds, tenths = divmod(rest, 10)
+        return make_packet(0xCE, (raw >> 8, raw & 0xFF, minutes & 0xFF, seconds, tenths, 0x00, 0x00))
+
+    def handle_command(self, cmd, now):
+        """Apply a command and return the reply packet, or None"""
+        self.commands.append(bytes(cmd))
+        self._last_command = now
+        if len(cmd) != 7 or cmd[0] != 0x03:
+            return None
+
+        type_ = cmd[1]
+        if type_ == 0x0F:
+            if cmd[2] != self.tare_counter:
+                # Duplicate writes of the same counter only tare once
+                self.tare_counter = cmd[2]
+                self.tare_offset = self.gross_weight(now)
+            return make_packet(0x0F, (cmd[2], 0x00, 0x00, 0xFE))
+        if type_ == 0x0A:
+            if cmd[2] in (0x00, 0x01):
+                self.led_on = cmd[2] == 0x01
+                self.unit = cmd[4]
+                return make_packet(0x0A, (cmd[2], self.unit, self.battery,
+                                          FIRMWARE_BYTES.get(self.firmware, 0x03)))
+            if cmd[2] == 0x02:
+                logger.info('Simulated scale %s powering off', self.address)
+                asyncio.get_event_loop().call_soon(self.disconnect)
+            # 0x03 is the heartbeat: nothing to do besides the timestamp above
+            return None
+        if type_ == 0x0B:
+            if cmd[2] == 0x03 and self.timer_started is None:
+                self.timer_started = now
+            elif cmd[2] == 0x00 and self.timer_started is not None:
+                self.timer_elapsed += now - self.timer_started
+                self.timer_started = None
+            elif cmd[2] == 0x02:
+                self.timer_elapsed = 0.0
+                if self.timer_started is not None:
+                    self.timer_started = now
+        return None
+
+    def attach(self, client, now):
+        if self.client is not None and self.client is not client:
+            raise BleakError("Simulated scale %s is already connected" % self.address)
+        self.client = client
+        self._last_command = now
+        if self._start is None:
+            self._start = now
+
+    def start_streaming(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._stream())
+
+    def stop_streaming(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def disconnect(self):
+        """Drop the connection from the scale side"""
+        self.stop_streaming()
+        client, self.client = self.client, None
+        if client is not None:
+            client.drop()
+
+    async def _stream(self):
+        loop = asyncio.get_event_loop()
+        period = 1.0 / self.rate
+        next_time = loop.time()
+        while self.client is not None:
+            now = loop.time()
+            if self.heartbeat_timeout and now - self._last_command > self.heartbeat_timeout:
+                logger.info('Simulated scale %s: heartbeat timeout', self.address)
+                self.disconnect()
+                return
+            if self.packet_loss and self.random.random() < self.packet_loss:
+                self.packets_lost += 1
+            else:
+                self.packets_sent += 1
+                self.client.notify(self.weight_packet(now))
+            next_time += period
+            if self.jitter:
+                next_time += self.random.uniform(-self.jitter, self.jitter)
+            await asyncio.sleep(max(0.0, next_time - loop.time()))
+
+
+class SimulatedClient(FakeBleakClient):
+    """BleakClient replacement connected to a SimulatedScale on a SimulatedBus"""
+
+    def __init__(self, address, disconnected_callback=None, bus=None, **kwargs):
+        super().__init__(getattr(address, 'address', address), disconnected_callback, responder=None)
+        self.bus = bus
+
+    @property
+    def scale(self):
+        return self.bus.scales.get(self.address)
+
+    async def connect(self, timeout=None, **kwargs):
+        scale = self.scale
+        if scale is None:
+            raise BleakError("Device with address %s was not found" % self.address)
+        scale.attach(self, asyncio.get_event_loop().time())
+        self.is_connected = True
+        return True
+
+    async def disconnect(self):
+        scale = self.scale
+        if scale is not None and scale.client is self:
+            scale.stop_streaming()
+            scale.client = None
+        return await super().disconnect()
+
+    async def start_notify(self, char, callback, **kwargs):
+        await super().start_notify(char, callback, **kwargs)
+        self.scale.start_streaming()
+
+    async def stop_notify(self, char):
+        await super().stop_notify(char)
+        self.scale.stop_streaming()
+
+    async def write_gatt_char(self, char, data, response=None):
+        await super().write_gatt_char(char, data, response)
+        scale = self.scale
+        loop = asyncio.get_event_loop()
+        reply = scale.handle_command(data, loop.time())
+        if reply is not None:
+            if scale.response_delay:
+                loop.call_later(scale.response_delay, self.notify, reply)
+            else:
+                loop.call_soon(self.notify, reply)
+
+
+class _AdvertisementData(object):
+    def __init__(self, local_name):
+        self.local_name = local_name
+
+
+class SimulatedScanner(object):
+    """BleakScanner replacement that discovers the scales on a SimulatedBus"""
+
+    def __init__(self, bus):
+        self.bus = bus
+
+    def __call__(self, detection_callback=None, **kwargs):
+        return _SimulatedScan(self.bus, detection_callback)
+
+    async def find_device_by_filter(self, filterfunc, timeout=10.0, **kwargs):
+        await asyncio.sleep(0)
+        for scale in list(self.bus.scales.values()):
+            device = scale.device
+            if filterfunc(device, _AdvertisementData(device.name)):
+                return device
+        return None
+
+    async def discover(self, timeout=5.0, **kwargs):
+        await asyncio.sleep(0)
+        return [scale.device for scale in self.bus.scales.values()]
+
+
+class _SimulatedScan(object):
+
+    def __init__(self, bus, detection_callback):
+        self.bus = bus
+        self.detection_callback = detection_callback
+
+    async def __aenter__(self):
+        if self.detection_callback is not None:
+            loop = asyncio.get_event_loop()
+            for scale in list(self.bus.scales.values()):
+                loop.call_soon(self.detection_callback, scale.device, _AdvertisementData(scale.device.name))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class SimulatedBus(object):
+    """A set of virtual scales reachable through ``client_factory`` and ``scanner``"""
+
+    def __init__(self):
+        self.scales = {}
+        self.scanner = SimulatedScanner(self)
+
+    def add_scale(self, address=None, **kwargs):
+        """Create a SimulatedScale (see its arguments) and make it discoverable"""
+        if address is None:
+            address = 'SI:M0:00:00:%02X:%02X' % divmod(len(self.scales), 256)
+        scale = self.scales[address] = SimulatedScale(address, **kwargs)
+        return scale
+
+    def remove_scale(self, address):
+        scale = self.scales.pop(address)
+        scale.disconnect()
+
+    def client_factory(self, address, disconnected_callback=None, **kwargs):
+        return SimulatedClient(address, disconnected_callback, bus=self)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Weight sample streams backed by a fixed-size ring buffer.
+
+Every weight notification is pushed into each open WeightStream, so
+consumers see every sample instead of whatever a polling loop happens to
+catch. A stream can be consumed with ``async for`` (on the scale's event
+loop) or with a plain ``for`` loop from another thread.
+"""
+
+import asyncio
+import threading
+from typing import NamedTuple, Optional
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+class WeightSample(NamedTuple):
+    """A single weight reading.
+
+    ``host_ns`` is ``time.monotonic_ns()`` when the notification arrived,
+    ``weight`` is in grams, ``raw`` is the signed value sent by the scale
+    (grams x 10) and ``device_time`` is the scale timer in deciseconds
+    (firmware v1.2+, otherwise None). Being a NamedTuple it has no instance
+    ``__dict__``, which keeps long recordings small.
+    """
+    host_ns: int
+    weight: float
+    raw: int
+    device_time: Optional[int]
+
+    @property
+    def timestamp(self):
+        """The device time as a dict of minutes, seconds, deciseconds, or None"""
+        if self.device_time is None:
+            return None
+        minutes, rest = divmod(self.device_time, 600)
+        seconds, deciseconds = divmod(rest, 10)
+        return {'minutes': minutes, 'seconds': seconds, 'deciseconds': deciseconds}
+
+    def as_dict(self):
+        """The weight and timestamp in the format of get_weight_with_timestamp()"""
+        return {'weight': self.weight, 'timestamp': self.timestamp}
+
+
+class WeightStream(object):
+    """Fixed-size ring buffer of WeightSample with a configurable overflow policy.
+
+    ``overflow`` decides what happens when the consumer falls behind and the
+    buffer is full:
+
+    - ``'drop_oldest'``: the oldest sample is overwritten (default)
+    - ``'drop_newest'``: the incoming sample is discarded
+    - ``'block'``: the producer waits up to ``block_timeout`` seconds for
+      space, then discards the incoming sample. The producer is the event
+      loop thread, so this is only allowed for consumers on another thread.
+
+    Discarded samples are counted in ``dropped``. ``on_close`` is called once
+    when the stream is closed, so the scale can unsubscribe it.
+    """
+
+    def __init__(self, capacity=256, overflow=DROP_OLDEST, block_timeout=1.0, on_close=None):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("overflow must be one of %s" % ', '.join(OVERFLOW_POLICIES))
+        self.capacity = capacity
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.on_close = on_close
+        self.dropped = 0
+        self.closed = False
+        self._items = [None] * capacity
+        self._head = 0
+        self._size = 0
+        self._cond = threading.Condition()
+        self._waiter = None  # (loop, future) of a waiting async consumer
+
+    def __len__(self):
+        return self._size
+
+    def put(self, sample):
+        """Add a sample, applying the overflow policy if the buffer is full.
+        Returns False if the sample was discarded."""
+        with self._cond:
+            if self.closed:
+                return False
+            if self._size == self.capacity:
+                if self.overflow == DROP_OLDEST:
+                    self._head = (self._head + 1) % self.capacity
+                    self._size -= 1
+                    self.dropped += 1
+                elif self.overflow == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                elif not self._cond.wait_for(self._has_space, self.block_timeout) or self.closed:
+                    self.dropped += 1
+                    return False
+            self._items[(self._head + self._size) % self.capacity] = sample
+            self._size += 1
+            self._cond.notify()
+            self._wake()
+        return True
+
+    def _has_space(self):
+        return self._size < self.capacity or self.closed
+
+    def _has_items(self):
+        return self._size > 0 or self.closed
+
+    def _wake(self):
+        if self._waiter is not None:
+            loop, future = self._waiter
+            self._waiter = None
+            loop.call_soon_threadsafe(_set_done, future)
+
+    def _pop(self):
+        sample = self._items[self._head]
+        self._items[self._head] = None
+        self._head = (self._head + 1) % self.capacity
+        self._size -= 1
+        self._cond.notify()
+        return sample
+
+    def get(self, timeout=None):
+        """Return the next sample, blocking up to ``timeout`` seconds.
+        Returns None on timeout or when the stream is closed and empty."""
+        with self._cond:
+            if not self._cond.wait_for(self._has_items, timeout) or not self._size:
+                return None
+            return self._pop()
+
+    async def get_async(self):
+        """Return the next sample, or None when the stream is closed and empty."""
+        while True:
+            with self._cond:
+                if self._size:
+                    return self._pop()
+                if self.closed:
+                    return None
+                loop = asyncio.get_event_loop()
+                future = loop.create_future()
+                self._waiter = (loop, future)
+            await future
+
+    def drain(self):
+        """Return all buffered samples without blocking."""
+        with self._cond:
+            samples = [self._pop() for _ in range(self._size)]
+        return samples
+
+    def close(self):
+        """Stop receiving samples. Buffered samples can still be read."""
+        with self._cond:
+            if self.closed:
+                return
+            self.closed = True
+            self._cond.notify_all()
+            self._wake()
+        if self.on_close is not None:
+            self.on_close(self)
+
+    def __iter__(self):
+        while True:
+            sample = self.get()
+            if sample is None:
+                return
+            yield sample
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        sample = await self.get_async()
+        if sample is None:
+            raise StopAsyncIteration
+        return sample
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+def _set_done(future):
+    if not future.done():
+        future.set_result(None)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Links between AsyncDecentScale and a scale.
+
+AsyncDecentScale talks to its link through the small BleakClient surface it
+has always used (connect, start_notify, write_gatt_char, stop_notify,
+disconnect, is_connected and the disconnected callback), so BLE goes through
+BleakClient unchanged. Transport implements that surface on top of four
+primitives for other links:
+
+    open()              connect to the scale
+    write(data)         send one command packet
+    close()             release the link
+    packet_received()   called by the subclass for every packet from the scale
+
+The packets are the binary scale packets, so every link shares the same
+NotificationDecoder, acknowledgements, retries, heartbeat, streams and
+recorder. client_for() picks the link from the address:
+
+    'AA:BB:CC:DD:EE:FF' or a BLEDevice   BLE (BleakClient)
+    'usb' or 'usb:1a86:7522'              USB serial, see pydecentscale.usb
+    'ws://hds.local'                      WiFi WebSocket, see pydecentscale.wifi
+"""
+
+import asyncio
+import functools
+import logging
+
+from bleak import BleakClient
+
+logger = logging.getLogger(__name__)
+
+
+# Weight packets by raw value, built on first use. Text and JSON weights
+# repeat a lot, so most lookups avoid building a packet.
+_weight_packets = {}
+
+
+def weight_packet(grams):
+    """The 7-byte weight packet for ``grams`` (immutable, shared), for links
+    that report weights as text"""
+    raw = round(grams * 10)
+    packet = _weight_packets.get(raw)
+    if packet is None:
+        clamped = min(max(raw, -0x8000), 0x7FFF)
+        hi = clamped >> 8 & 0xFF
+        lo = clamped & 0xFF
+        packet = bytes((0x03, 0xCE, hi, lo, 0x00, 0x00, 0x03 ^ 0xCE ^ hi ^ lo))
+        if len(_weight_packets) > 0x10000:
+            _weight_packets.clear()
+        _weight_packets[raw] = packet
+    return packet
+
+
+class Transport(object):
+    """Base class for non-BLE links, usable as an AsyncDecentScale client.
+
+    ``acknowledges`` is False for links on which the scale does not answer
+    commands, so the command engine does not wait for acknowledgements.
+    """
+
+    acknowledges = True
+
+    def __init__(self, address, disconnected_callback=None, **kwargs):
+        self.address = address
+        self.disconnected_callback = disconnected_callback
+        self.is_connected = False
+        self.loop = None
+        self._callback = None
+        self._char = None
+
+    @classmethod
+    def factory(cls, **kwargs):
+        """A client_factory for AsyncDecentScale creating this transport with ``kwargs``"""
+        return functools.partial(cls, **kwargs)
+
+    async def open(self):
+        raise NotImplementedError
+
+    async def write(self, data):
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+    def packet_received(self, data):
+        """Deliver a packet from the scale; must be called on the event loop"""
+        if self._callback is not None:
+            self._callback(self._char, data)
+
+    def connection_lost(self):
+        """Report that the link dropped; must be called on the event loop"""
+        if not self.is_connected:
+            return
+        self.is_connected = False
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+
+    # BleakClient-compatible interface used by AsyncDecentScale
+
+    async def connect(self, timeout=None, **kwargs):
+        self.loop = asyncio.get_event_loop()
+        await asyncio.wait_for(self.open(), timeout)
+        self.is_connected = True
+        return True
+
+    async def disconnect(self):
+        if self.is_connected:
+            self.is_connected = False
+            self._callback = None
+            await self.close()
+        return True
+
+    async def start_notify(self, char, callback, **kwargs):
+        self._char = char
+        self._callback = callback
+
+    async def stop_notify(self, char):
+        self._callback = None
+
+    async def write_gatt_char(self, char, data, response=None):
+        if not self.is_connected:
+            raise ConnectionError("%s is not connected" % self.address)
+        await self.write(data)
+
+
+def client_for(address, disconnected_callback=None, **kwargs):
+    """Default client_factory of AsyncDecentScale: choose the link from ``address``"""
+    if isinstance(address, str):
+        if address == 'usb' or address.startswith('usb:'):
+            from .usb import UsbTransport
+            return UsbTransport(address, disconnected_callback, **kwargs)
+        if address.startswith(('ws://', 'wss://')):
+            from .wifi import WebSocketTransport
+            return WebSocketTransport(address, disconnected_callback, **kwargs)
+
+    return BleakClient(address, disconnected_callback=disconnected_callback, **kwargs)
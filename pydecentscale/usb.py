@@ -0,0 +1,411 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""USB serial link to a Half Decent Scale (CH340 bridge).
+
+The scale sends the same binary packets over USB as over BLE once weight
+streaming has been enabled with ``03 20 01``; the command is repeated every
+``keepalive`` seconds so the stream does not lapse. Requires pyusb
+(``pip install pydecentscale[usb]``).
+
+    scale = AsyncDecentScale()
+    await scale.connect('usb')              # or 'usb:1a86:7522'
+"""
+
+import array
+import asyncio
+import collections
+import logging
+import threading
+import time
+
+from .transport import Transport, weight_packet
+
+logger = logging.getLogger(__name__)
+
+VENDOR_ID = 0x1A86
+PRODUCT_ID = 0x7522
+
+ENABLE_WEIGHT_COMMAND = bytes.fromhex('032001')
+
+# Consumed bytes are dropped from the front of the buffer only once they
+# exceed this size, so compaction is amortized O(1) per byte
+COMPACT_AFTER = 4096
+
+# Longest text line accepted before the bytes are treated as noise
+MAX_LINE = 256
+
+
+def parse_address(address):
+    """Return ``(vendor_id, product_id)`` for 'usb' or 'usb:<vid>:<pid>' (hex)"""
+    parts = address.split(':')
+    if len(parts) == 3:
+        return int(parts[1], 16), int(parts[2], 16)
+    return VENDOR_ID, PRODUCT_ID
+
+
+# Weight packets by text line (without the newline). A scale repeats the
+# same few hundred weights, so most lines are parsed by a single lookup.
+# Bounded like the weight packet cache in transport.py.
+_line_packets = {}
+
+
+def _weight_lines(lines, packets):
+    """Append the packets of the ``Weight:`` lines among ``lines`` (bytes) to
+    ``packets``; return the number of bytes of the other lines"""
+    skipped = 0
+    append = packets.append
+    cached = _line_packets.get
+    for line in lines:
+        packet = cached(line)
+        if packet is None:
+            label = line.find(b'Weight:')
+            if label == -1:
+                skipped += len(line) + 1
+                continue
+            try:
+                packet = weight_packet(float(line[label + 7:]))
+            except (ValueError, OverflowError):
+                skipped += len(line) + 1
+                continue
+            if len(_line_packets) > 0x10000:
+                _line_packets.clear()
+            _line_packets[line] = packet
+        append(packet)
+    return skipped
+
+
+class FrameParser(object):
+    """Incremental parser splitting a serial byte stream into scale packets.
+
+    ``feed(data)`` appends the bytes read from the port and returns the
+    complete packets found so far. The parser keeps a read offset into its
+    buffer instead of slicing consumed bytes off after every packet, and
+    searches from that offset, so parsing is linear in the number of bytes
+    received, however large the bursts.
+
+    Depending on its firmware the scale sends binary packets or text lines
+    such as ``Weight: 12.3``; the protocol is detected for every frame,
+    ``protocol`` holds the one last seen and ``binary_frames`` counts the
+    binary packets since the last reset. Weight lines are returned as
+    7-byte weight packets, so both protocols go through the same decoder.
+    While the stream is text and no 0x03 byte arrives, each read is split
+    into lines in one pass, with the incomplete last line kept aside, and
+    a line seen before is turned into its packet by a single lookup.
+
+    Binary packets must pass the XOR check. Weight packets are 7 bytes, or
+    10 bytes with the timer on firmware v1.2+; the length that last
+    validated is tried first, so a single stream settles on its firmware's
+    format. Other packets are 7 bytes. On a bad byte the parser
+    resynchronizes on the next 0x03 header. ``skipped`` counts the bytes
+    that were neither part of a packet nor of a weight line.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.pos = 0
+        self.weight_length = None
+        self.protocol = None
+        self.frames = 0
+        self.skipped = 0
+        self.binary_frames = 0
+        self._scanned = 0  # End of the bytes already searched for a newline
+        self._partial = b''  # Incomplete last line of a text stream
+
+    def reset(self):
+        self.buffer = bytearray()
+        self.pos = 0
+        self.weight_length = None
+        self.protocol = None
+        self.binary_frames = 0
+        self._scanned = 0
+        self._partial = b''
+
+    def feed(self, data):
+        if self.protocol == 'text':
+            # The buffer is empty and an incomplete line is kept in _partial
+            chunk = self._partial + data
+            if 0x03 not in chunk:
+                return self._feed_text(chunk)
+            self._scanned = len(self._partial)
+            self._partial = b''
+            self.buffer = buf = bytearray(chunk)
+        else:
+            buf = self.buffer
+            buf += data
+        end = len(buf)
+        pos = self.pos
+        find = buf.find
+        weight_length = self.weight_length
+        packets = []
+        skipped = 0
+        binary = 0
+        protocol = self.protocol
+        header = -2  # Position of the next 0x03 byte; -1 if none, -2 if not searched yet
+        while pos < end:
+            if buf[pos] != 0x03:
+                # A text line, or noise before the next binary packet.
+                # Text never contains 0x03, so a line must end before it.
+                scan = self._scanned if self._scanned > pos else pos
+                if header < pos and header != -1:
+                    # The next header is searched once for a run of lines
+                    header = find(0x03, scan)
+                newline = find(0x0A, scan, end if header == -1 else header)
+                if newline == -1:
+                    if header != -1:
+                        skipped += header - pos
+                        pos = header
+                        continue
+                    if end - pos > MAX_LINE:
+                        skipped += end - pos
+                        pos = end
+                    else:
+                        self._scanned = end
+                    break
+                # Parse every complete line up to the next header at once
+                last = buf.rfind(0x0A, newline, end if header == -1 else header)
+                count = len(packets)
+                skipped += _weight_lines(bytes(buf[pos:last]).split(b'\n'), packets)
+                if len(packets) > count:
+                    protocol = 'text'
+                pos = last + 1
+                continue
+
+            available = end - pos
+            if available < 7:
+                break
+            # XOR checks inlined: this loop runs for every packet
+            type_ = buf[pos + 1]
+            xor = 0x03 ^ type_ ^ buf[pos + 2] ^ buf[pos + 3] ^ buf[pos + 4] ^ buf[pos + 5]
+            if type_ != 0xCE and type_ != 0xCA:
+                length = 7 if xor == buf[pos + 6] else 0
+            elif weight_length == 7 and xor == buf[pos + 6]:
+                length = 7
+            elif available < 10:
+                # A 10-byte weight packet may still be arriving
+                break
+            elif xor ^ buf[pos + 6] ^ buf[pos + 7] ^ buf[pos + 8] == buf[pos + 9]:
+                length = weight_length = 10
+            elif xor == buf[pos + 6]:
+                length = weight_length = 7
+            else:
+                length = 0
+
+            if length:
+                packets.append(buf[pos:pos + length])
+                pos += length
+                binary += 1
+                protocol = 'binary'
+            else:
+                skipped += 1
+                pos += 1
+
+        if protocol == 'text':
+            self._partial = bytes(buf[pos:])
+            buf.clear()
+            pos = 0
+            self._scanned = 0
+        elif pos >= end:
+            buf.clear()
+            pos = 0
+            self._scanned = 0
+        elif pos > COMPACT_AFTER:
+            del buf[:pos]
+            self._scanned = max(0, self._scanned - pos)
+            pos = 0
+        self.pos = pos
+        self.weight_length = weight_length
+        self.protocol = protocol
+        self.skipped += skipped
+        self.binary_frames += binary
+        self.frames += len(packets)
+        return packets
+
+    def _feed_text(self, chunk):
+        """Packets of the complete lines of ``chunk``, text without a 0x03
+        byte that starts with the incomplete line of the previous read"""
+        lines = chunk.split(b'\n')
+        partial = lines.pop()
+        if len(partial) > MAX_LINE:
+            self.skipped += len(partial)
+            partial = b''
+        self._partial = partial
+        packets = []
+        if lines:
+            self.skipped += _weight_lines(lines, packets)
+            self.frames += len(packets)
+        return packets
+
+
+class UsbTransport(Transport):
+    """Transport over the scale's USB serial port.
+
+    A background thread does bulk reads of up to ``read_size`` bytes into a
+    preallocated buffer (the CH340 ends a transfer on a short packet, so
+    large reads add no latency) and parses them with a FrameParser. Packets
+    are handed to the event loop through a deque, with at most one pending
+    wakeup of the loop however many packets arrive; if the loop falls more
+    than ``queue_size`` packets behind, the oldest are dropped and counted
+    in ``dropped``. The weight-enable keepalive runs as a task on the loop.
+
+    ``bytes_per_second`` and ``packets_per_second`` are updated once per
+    second; ``bytes_read``, ``packets``, ``dropped`` and ``parser.skipped``
+    are running totals.
+    """
+
+    def __init__(self, address='usb', disconnected_callback=None, keepalive=2.0, read_size=4096,
+                 read_timeout=200, queue_size=1024, **kwargs):
+        super().__init__(address, disconnected_callback)
+        self.vendor_id, self.product_id = parse_address(address)
+        self.keepalive = keepalive
+        self.read_size = read_size
+        self.read_timeout = read_timeout
+        self.dev = None
+        self.ep_in = None
+        self.ep_out = None
+        self.read_thread = None
+        self.keepalive_task = None
+        self.parser = FrameParser()
+        self.queue = collections.deque(maxlen=queue_size)
+        self.bytes_read = 0
+        self.packets = 0
+        self.dropped = 0
+        self.bytes_per_second = 0.0
+        self.packets_per_second = 0.0
+        self._reading = False
+        self._wakeup_pending = False
+
+    @property
+    def acknowledges(self):
+        """Only binary-protocol firmware answers commands; text-protocol
+        scales (``Weight:`` lines) never send acknowledgements, so commands
+        are not waited for until a binary packet has been received"""
+        return self.parser.binary_frames > 0
+
+    async def open(self):
+        await self.loop.run_in_executor(None, self._open_device)
+        self._reading = True
+        self.read_thread = threading.Thread(target=self._read_loop, name='DecentScaleUSB', daemon=True)
+        self.read_thread.start()
+        self.keepalive_task = asyncio.ensure_future(self._keepalive_loop())
+
+    def _open_device(self):
+        import usb.core
+        import usb.util
+
+        dev = usb.core.find(idVendor=self.vendor_id, idProduct=self.product_id)
+        if dev is None:
+            raise ConnectionError("USB device %04x:%04x not found" % (self.vendor_id, self.product_id))
+        if dev.is_kernel_driver_active(0):
+            dev.detach_kernel_driver(0)
+        dev.set_configuration()
+        # CH340 initialization sequence
+        dev.ctrl_transfer(0x40, 0x9A, 0x2518, 0x0000, None)
+        dev.ctrl_transfer(0x40, 0x9A, 0x2518, 0x00C3, None)
+
+        intf = dev.get_active_configuration()[(0, 0)]
+        direction = usb.util.endpoint_direction
+        self.ep_in = usb.util.find_descriptor(
+            intf, custom_match=lambda e: direction(e.bEndpointAddress) == usb.util.ENDPOINT_IN)
+        self.ep_out = usb.util.find_descriptor(
+            intf, custom_match=lambda e: direction(e.bEndpointAddress) == usb.util.ENDPOINT_OUT)
+        if self.ep_in is None or self.ep_out is None:
+            usb.util.dispose_resources(dev)
+            raise ConnectionError("Could not find the USB IN/OUT endpoints")
+        self.dev = dev
+        self.dev.write(self.ep_out.bEndpointAddress, ENABLE_WEIGHT_COMMAND)
+
+    def _read_loop(self):
+        import usb.core
+
+        parser = self.parser
+        parser.reset()
+        queue = self.queue
+        read = self.dev.read
+        endpoint = self.ep_in.bEndpointAddress
+        # Whole USB packets, so a transfer never overflows the buffer
+        packet_size = self.ep_in.wMaxPacketSize
+        buffer = array.array('B', bytes(max(packet_size, self.read_size // packet_size * packet_size)))
+        view = memoryview(buffer)
+        window_start = time.monotonic()
+        window_bytes = window_packets = 0
+
+        while self._reading:
+            try:
+                n = read(endpoint, buffer, timeout=self.read_timeout)
+            except usb.core.USBTimeoutError:
+                n = 0
+            except usb.core.USBError as e:
+                if self._reading:
+                    logger.error("USB read error: %s", e)
+                    self._reading = False
+                    self.loop.call_soon_threadsafe(self.connection_lost)
+                break
+
+            if n:
+                packets = parser.feed(view[:n])
+                window_bytes += n
+                if packets:
+                    window_packets += len(packets)
+                    overflow = len(queue) + len(packets) - queue.maxlen
+                    if overflow > 0:
+                        self.dropped += overflow
+                    queue.extend(packets)
+                    if not self._wakeup_pending:
+                        self._wakeup_pending = True
+                        self.loop.call_soon_threadsafe(self._deliver)
+
+            now = time.monotonic()
+            if now - window_start >= 1.0:
+                elapsed = now - window_start
+                self.bytes_read += window_bytes
+                self.packets += window_packets
+                self.bytes_per_second = window_bytes / elapsed
+                self.packets_per_second = window_packets / elapsed
+                window_start = now
+                window_bytes = window_packets = 0
+
+        self.bytes_read += window_bytes
+        self.packets += window_packets
+
+    def _deliver(self):
+        # Clear the flag first: packets queued while draining schedule a new wakeup
+        self._wakeup_pending = False
+        queue = self.queue
+        while queue:
+            self.packet_received(queue.popleft())
+
+    async def _keepalive_loop(self):
+        """Repeat the weight-enable command so the scale keeps streaming"""
+        while True:
+            await asyncio.sleep(self.keepalive)
+            try:
+                await self.write(ENABLE_WEIGHT_COMMAND)
+            except Exception as e:
+                logger.warning("USB keepalive failed: %s", e)
+
+    def connection_lost(self):
+        if self.keepalive_task is not None:
+            self.keepalive_task.cancel()
+            self.keepalive_task = None
+        super().connection_lost()
+
+    async def write(self, data):
+        await self.loop.run_in_executor(None, self.dev.write, self.ep_out.bEndpointAddress, bytes(data))
+
+    async def close(self):
+        import usb.util
+
+        if self.keepalive_task is not None:
+            self.keepalive_task.cancel()
+            self.keepalive_task = None
+        self._reading = False
+        if self.read_thread is not None:
+            await self.loop.run_in_executor(None, self.read_thread.join)
+            self.read_thread = None
+        self.queue.clear()
+        if self.dev is not None:
+            usb.util.dispose_resources(self.dev)
+            self.dev = None
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""WiFi WebSocket link to a Half Decent Scale (firmware v3.0.0+).
+
+The scale pushes JSON snapshots such as ``{"grams": 12.3}`` on
+``ws://<host>/snapshot`` and accepts the text command ``tare``. Snapshots are
+converted into ordinary weight packets so they go through the shared
+decoder. Requires websockets (``pip install pydecentscale[wifi]``).
+
+    scale = AsyncDecentScale()
+    await scale.connect('ws://hds.local')
+
+Snapshots are parsed with orjson when it is installed, otherwise with a
+hand-rolled extractor of the ``grams`` field.
+
+Any number of WiFi scales can share one event loop through
+AsyncScaleManager, e.g. ``await manager.connect_all(['ws://hds-1.local',
+'ws://hds-2.local'])``. Host names are resolved once and cached in
+``RESOLVER``, so reconnects do not wait for another mDNS lookup.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import socket
+import time
+from urllib.parse import urlsplit
+
+from .transport import Transport, weight_packet
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PATH = '/snapshot'
+
+
+def snapshot_uri(address):
+    """``ws://host`` -> ``ws://host/snapshot``; URIs with a path are kept"""
+    scheme, _, rest = address.partition('://')
+    if '/' not in rest:
+        return address + SNAPSHOT_PATH
+    return address
+
+
+def _json_grams(message, loads=json.loads):
+    try:
+        grams = loads(message).get('grams')
+        if grams is None:
+            return None
+        grams = float(grams)
+        if math.isfinite(grams):
+            return grams
+    except (ValueError, TypeError, AttributeError):
+        pass
+    logger.warning("Invalid snapshot: %r", message)
+    return None
+
+
+def extract_grams(message):
+    """The ``grams`` value of a snapshot (str or bytes), or None when it is
+    missing or not a finite number.
+
+    Snapshots are small flat objects, so the value is read straight after
+    the key. A ``"grams"`` not followed by a colon is a string value, not the
+    key; that and anything else unexpected falls back to json.loads.
+    """
+    if isinstance(message, str):
+        key, colon, comma, brace = '"grams"', ':', ',', '}'
+    else:
+        key, colon, comma, brace = b'"grams"', b':', b',', b'}'
+    i = message.find(key)
+    if i != -1:
+        i += 7
+        while message[i:i + 1].isspace():
+            i += 1
+        if message[i:i + 1] == colon:
+            start = i + 1
+            end = message.find(comma, start)
+            close = message.find(brace, start)
+            if end == -1 or -1 < close < end:
+                end = close
+            if end != -1:
+                try:
+                    grams = float(message[start:end])
+                except ValueError:
+                    pass
+                else:
+                    if math.isfinite(grams):
+                        return grams
+                    logger.warning("Invalid snapshot: %r", message)
+                    return None
+    return _json_grams(message)
+
+
+if orjson is not None:
+    def parse_grams(message):
+        """The ``grams`` value of a snapshot (str or bytes), or None (orjson)"""
+        return _json_grams(message, orjson.loads)
+else:
+    parse_grams = extract_grams
+
+
+class HostCache(object):
+    """Addresses of scale host names, resolved once and kept for ``ttl`` seconds.
+
+    Resolving ``hds.local`` over mDNS can take seconds; with the cache only
+    the first connection to a scale (and the first after a failed
+    connection) waits for it.
+    """
+
+    def __init__(self, ttl=600.0):
+        self.ttl = ttl
+        self.addresses = {}
+
+    async def resolve(self, host, port):
+        loop = asyncio.get_event_loop()
+        entry = self.addresses.get(host)
+        if entry is not None and loop.time() - entry[1] < self.ttl:
+            return entry[0]
+        infos = await loop.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        address = infos[0][4][0]
+        self.addresses[host] = (address, loop.time())
+        return address
+
+    def forget(self, host):
+        self.addresses.pop(host, None)
+
+
+# Shared by every WebSocketTransport unless another cache is passed
+RESOLVER = HostCache()
+
+
+class WebSocketTransport(Transport):
+    """Transport over the scale's WebSocket snapshot endpoint.
+
+    The scale does not acknowledge commands on this link, and only tare is
+    supported; other commands are ignored. Per-message compression is
+    disabled: snapshots are tiny and arrive at the scale's sample rate.
+
+    With ``coalesce`` set, snapshots that arrive while the event loop is
+    busy are merged: only the latest is decoded and delivered once the loop
+    gets to it, so a stalled consumer catches up in one step instead of
+    working through a backlog. ``messages`` counts every snapshot received
+    and ``coalesced`` those skipped this way. ``archive``, if given, is
+    called as ``archive(packet, host_ns)`` for every snapshot, delivered or
+    not, e.g. with a SessionRecorder's ``record`` method.
+    """
+
+    acknowledges = False
+
+    def __init__(self, address='ws://hds.local', disconnected_callback=None, resolver=None,
+                 coalesce=False, archive=None, ping_interval=30, ping_timeout=10, close_timeout=5, max_size=2 ** 16, **kwargs):
+        super().__init__(address, disconnected_callback)
+        self.uri = snapshot_uri(address)
+        parts = urlsplit(self.uri)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'wss' else 80)
+        self.resolver = resolver or RESOLVER
+        self.connect_kwargs = dict(ping_interval=ping_interval, ping_timeout=ping_timeout,
+                                   close_timeout=close_timeout, max_size=max_size, compression=None)
+        self.coalesce = coalesce
+        self.archive = archive
+        self.messages = 0
+        self.coalesced = 0
+        self.invalid = 0
+        self.websocket = None
+        self.reader_task = None
+        self._latest = None
+
+    async def open(self):
+        import websockets
+
+        address = await self.resolver.resolve(self.host, self.port)
+        try:
+            # Connect to the cached address; the URI still provides the Host header
+            self.websocket = await websockets.connect(self.uri, host=address, port=self.port,
+                                                      **self.connect_kwargs)
+        except Exception:
+            self.resolver.forget(self.host)
+            raise
+        self.reader_task = asyncio.ensure_future(self._read_loop())
+
+    async def _read_loop(self):
+        import websockets
+
+        try:
+            async for message in self.websocket:
+                self.messages += 1
+                if self.coalesce and self.archive is None:
+                    # Snapshots that end up skipped are never parsed
+                    self._coalesce(message, False)
+                    continue
+                packet = self._packet(message)
+                if packet is None:
+                    continue
+                if self.archive is not None:
+                    self._archive(packet)
+                if self.coalesce:
+                    self._coalesce(packet, True)
+                else:
+                    self.packet_received(packet)
+        except websockets.exceptions.WebSocketException as e:
+            logger.warning("Connection to %s lost: %s", self.uri, e)
+        except Exception:
+            logger.error("Reading from %s failed", self.uri, exc_info=True)
+        finally:
+            # Whatever ended the loop, the scale must not stay connected with
+            # a stale weight; after disconnect() this is a no-op
+            try:
+                self._deliver_latest()
+            finally:
+                self.connection_lost()
+
+    def _packet(self, message):
+        """The weight packet of a snapshot, or None (counted in ``invalid``)"""
+        grams = parse_grams(message)
+        if grams is not None:
+            try:
+                return weight_packet(grams)
+            except (OverflowError, ValueError):
+                pass
+        self.invalid += 1
+        return None
+
+    def _archive(self, packet):
+        try:
+            self.archive(packet, time.monotonic_ns())
+        except Exception:
+            # e.g. the recorder was closed; keep delivering weights
+            logger.error("Archiving snapshots from %s failed; archiving stopped", self.uri, exc_info=True)
+            self.archive = None
+
+    def _coalesce(self, item, parsed):
+        if self._latest is not None:
+            self.coalesced += 1
+        else:
+            self.loop.call_soon(self._deliver_latest)
+        self._latest = (item, parsed)
+
+    def _deliver_latest(self):
+        latest, self._latest = self._latest, None
+        if latest is None:
+            return
+        item, parsed = latest
+        if not parsed:
+            item = self._packet(item)
+            if item is None:
+                return
+        self.packet_received(item)
+
+    async def write(self, data):
+        if data[1] == 0x0F:
+            await self.websocket.send('tare')
+        else:
+            logger.debug("Command %s is not supported over WiFi", bytes(data).hex())
+
+    async def close(self):
+        if self.reader_task is not None:
+            self.reader_task.cancel()
+            self.reader_task = None
+        if self.websocket is not None:
+            await self.websocket.close()
+            self.websocket = None
@@ -25,5 +25,11 @@ setup(
     packages=find_packages(),
     install_requires=[
         'bleak','asyncio','nest_asyncio'     
-    ]
+    ],
+    extras_require={
+        'analytics': ['numpy'],
+        'usb': ['pyusb'],
+        'wifi': ['websockets'],
+        'orjson': ['orjson'],
+    }
 )
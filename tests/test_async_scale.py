@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""AsyncDecentScale against in-memory scales: command queue, acknowledgements
+and retries, cancellation. No Bluetooth adapter needed.
+
+    python -m pytest -q
+"""
+
+import asyncio
+import functools
+
+from pydecentscale import commands
+from pydecentscale.async_scale import AsyncDecentScale
+from pydecentscale.command_queue import HIGH
+from pydecentscale.replay import FakeBleakClient, scale_response
+from pydecentscale.simulator import SimulatedBus
+
+ADDRESS = 'FA:KE:00:00:00:01'
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def lose_tares(count):
+    """A scale_response that ignores the first ``count`` tare commands"""
+    lost = [count]
+
+    def responder(cmd):
+        if cmd[1] == 0x0F and lost[0]:
+            lost[0] -= 1
+            return None
+        return scale_response(cmd)
+    return responder
+
+
+async def connected(responder=scale_response, **kwargs):
+    """A scale connected to a FakeBleakClient, with the connection's writes cleared"""
+    kwargs.setdefault('ack_timeout', 0.02)
+    scale = AsyncDecentScale(client_factory=functools.partial(FakeBleakClient, responder=responder),
+                             fix_dropped_command=False, metrics=True, **kwargs)
+    assert await scale.connect(ADDRESS)
+    scale.client.writes.clear()
+    return scale
+
+
+def assert_idle(scale):
+    queue = scale.command_queue
+    assert not queue.queue and not queue.queued and not queue.in_flight
+    assert not scale.notification_handler.pending
+
+
+def test_acknowledged_command():
+    async def main():
+        scale = await connected()
+        acks = scale.metrics.acks
+        assert await scale.tare() is True
+        assert len(scale.client.writes) == 1
+        assert scale.metrics.acks == acks + 1
+        assert scale.metrics.ack_timeouts == 0
+        assert_idle(scale)
+        await scale.disconnect()
+    run(main())
+
+
+def test_command_resent_until_acknowledged():
+    async def main():
+        scale = await connected(lose_tares(2), command_retries=2)
+        assert await scale.tare() is True
+        # Resent with the same tare counter
+        assert len(scale.client.writes) == 3
+        assert len(set(scale.client.writes)) == 1
+        assert scale.metrics.ack_timeouts == 2
+        assert scale.metrics.unacknowledged == 0
+        await scale.disconnect()
+    run(main())
+
+
+def test_command_not_acknowledged_after_retries():
+    async def main():
+        scale = await connected(lose_tares(10), command_retries=2)
+        assert await scale.tare() is False
+        assert len(scale.client.writes) == 3
+        assert scale.metrics.ack_timeouts == 3
+        assert scale.metrics.unacknowledged == 1
+        assert_idle(scale)
+        await scale.disconnect()
+    run(main())
+
+
+def test_priority_order():
+    async def main():
+        scale = await connected()
+        results = await asyncio.gather(scale.led_off(), scale.power_off(), scale.start_time(), scale.tare())
+        assert results == [True, True, True, True]
+        writes = scale.client.writes
+        assert [w[1] for w in writes] == [0x0B, 0x0F, 0x0A, 0x0A]
+        assert writes[2] == commands.POWER_OFF
+        assert writes[3] == commands.LED_OFF
+        await scale.disconnect()
+    run(main())
+
+
+def test_led_commands_coalesced():
+    async def main():
+        scale = await connected()
+        results = await asyncio.gather(scale.led_on(), scale.led_off(), scale.led_on('oz'))
+        assert results == [True, True, True]
+        assert scale.client.writes == [commands.LED_ON_OUNCES]
+        assert scale.weight_unit == 'oz'
+        await scale.disconnect()
+    run(main())
+
+
+def test_cancelled_coalesced_caller():
+    async def main():
+        scale = await connected()
+        first = asyncio.ensure_future(scale.led_on())
+        second = asyncio.ensure_future(scale.led_on())
+        await asyncio.sleep(0)
+        second.cancel()
+        assert await first is True
+        assert second.cancelled()
+        assert scale.client.writes == [commands.LED_ON_GRAMS]
+        await scale.disconnect()
+    run(main())
+
+
+def test_cancel_before_write():
+    async def main():
+        scale = await connected()
+        future = scale.command_queue.submit(commands.TARE[0][1], (0x0F, 1), HIGH)
+        future.cancel()
+        assert await scale.start_time() is True
+        assert scale.client.writes == [commands.START_TIMER]
+        assert_idle(scale)
+        await scale.disconnect()
+    run(main())
+
+
+def test_cancel_after_write():
+    async def main():
+        scale = await connected(lose_tares(10))
+        task = asyncio.ensure_future(scale.tare())
+        while not scale.client.writes:
+            await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.sleep(scale.ack_timeout * 3)
+        assert task.cancelled()
+        # Not resent once its caller is gone
+        assert len(scale.client.writes) == 1
+        assert_idle(scale)
+        await scale.disconnect()
+    run(main())
+
+
+def test_queue_cleared_on_drop():
+    async def main():
+        bus = SimulatedBus()
+        sim = bus.add_scale()
+        scale = AsyncDecentScale(client_factory=bus.client_factory, scanner=bus.scanner,
+                                 fix_dropped_command=False, ack_timeout=5.0)
+        assert await scale.connect(sim.address)
+        # Acknowledgements now arrive after the link is dropped
+        sim.response_delay = 1.0
+        pending = [asyncio.ensure_future(call) for call in (scale.tare(), scale.led_off(), scale.start_time())]
+        while len(sim.commands) < 2:
+            await asyncio.sleep(0)
+        sim.disconnect()
+        assert await asyncio.gather(*pending) == [False, False, True]
+        assert not scale.connected
+        assert_idle(scale)
+    run(main())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""DeviceCache file handling and fast reconnects through it."""
+
+import asyncio
+import functools
+import json
+
+from pydecentscale.async_scale import AsyncDecentScale
+from pydecentscale.cache import DeviceCache
+from pydecentscale.replay import FakeBleakClient, scale_response
+from pydecentscale.simulator import SimulatedBus
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'devices.json')
+    cache = DeviceCache(path)
+    cache.update('AA', firmware_version='1.2', battery_level=80)
+    cache.update('BB', firmware_version='1.0')
+    cache.update('AA', battery_level=70)
+
+    reloaded = DeviceCache(path)
+    assert reloaded.get('AA')['battery_level'] == 70
+    assert reloaded.get('AA')['firmware_version'] == '1.2'
+    assert reloaded.addresses() == ['AA', 'BB']
+    assert reloaded.last_address() == 'AA'
+
+    reloaded.remove('AA')
+    assert DeviceCache(path).addresses() == ['BB']
+
+
+def test_unreadable_file_ignored(tmp_path):
+    path = tmp_path / 'devices.json'
+    path.write_text('{not json')
+    assert DeviceCache(str(path)).devices == {}
+    path.write_text(json.dumps(['not', 'a', 'dict']))
+    assert DeviceCache(str(path)).devices == {}
+    assert DeviceCache(str(tmp_path / 'missing' / 'devices.json')).devices == {}
+
+
+def test_auto_connect_tries_cached_address_first(tmp_path):
+    async def main():
+        bus = SimulatedBus()
+        sim = bus.add_scale(firmware='1.1')
+        cache = DeviceCache(str(tmp_path / 'devices.json'))
+        scale = AsyncDecentScale(client_factory=bus.client_factory, scanner=bus.scanner,
+                                 cache=cache, fix_dropped_command=False)
+        assert await scale.auto_connect()
+        await scale.disconnect()
+        assert cache.get(sim.address)['firmware_version'] == '1.1'
+
+        def no_scan(*args, **kwargs):
+            raise AssertionError('scanned although the address was cached')
+        scale = AsyncDecentScale(client_factory=bus.client_factory, scanner=no_scan,
+                                 cache=DeviceCache(cache.path), fix_dropped_command=False)
+        assert await scale.auto_connect()
+        await scale.disconnect()
+    asyncio.run(main())
+
+
+def test_cached_connect_refreshes_info_in_background(tmp_path):
+    async def main():
+        path = str(tmp_path / 'devices.json')
+        DeviceCache(path).update('AA', firmware_version='1.2', battery_level=90, weight_unit='oz')
+        factory = functools.partial(FakeBleakClient, responder=functools.partial(scale_response, battery=42))
+        scale = AsyncDecentScale(client_factory=factory, cache=DeviceCache(path), fix_dropped_command=False)
+        assert await scale.connect('AA')
+        # Connected without waiting for the info request
+        assert scale.battery_level == 90
+        assert scale.client.writes == []
+
+        await asyncio.sleep(0.01)
+        # The request keeps the cached unit
+        assert scale.client.writes == [scale.led_on_command_ounces]
+        assert (scale.battery_level, scale.weight_unit) == (42, 'oz')
+        assert DeviceCache(path).get('AA')['battery_level'] == 42
+        await scale.disconnect()
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""NotificationDecoder on single packets, against a plain scale object."""
+
+from types import SimpleNamespace
+
+from pydecentscale.decoder import NotificationDecoder
+from pydecentscale.metrics import INVALID, OK, UNKNOWN_TYPE, XOR_FAILED
+from pydecentscale.replay import make_packet
+from pydecentscale.stream import WeightSample
+
+
+class Resolvable(object):
+    """Stands in for a future in NotificationDecoder.pending"""
+
+    def __init__(self):
+        self.result = None
+
+    def done(self):
+        return self.result is not None
+
+    def set_result(self, result):
+        self.result = result
+
+
+def decoder():
+    scale = SimpleNamespace(weight=None, sample=None, weight_unit='g', battery_level=None, firmware_version=None)
+    decode = NotificationDecoder(scale)
+    decode.clock = lambda: 123
+    return scale, decode
+
+
+def test_weight_packets():
+    scale, decode = decoder()
+    samples = []
+    decode.listeners = [samples.append]
+
+    assert decode._decode(make_packet(0xCE, (0x01, 0x2C, 0, 0))) == OK
+    assert scale.weight == 30.0
+    assert scale.sample == WeightSample(123, 30.0, 300, None)
+
+    # Negative weight and the firmware v1.2 timer: 1 min 2.3 s
+    assert decode._decode(make_packet(0xCA, (0xFF, 0x9C, 1, 2, 3, 0, 0))) == OK
+    assert scale.weight == -10.0
+    assert scale.sample.device_time == 623
+    assert samples == [WeightSample(123, 30.0, 300, None), scale.sample]
+
+
+def test_rejected_packets():
+    scale, decode = decoder()
+    corrupt = make_packet(0xCE, (0, 10, 0, 0))
+    corrupt[-1] ^= 0xFF
+    assert decode._decode(corrupt) == XOR_FAILED
+    assert decode._decode(b'\x03\xce\x00') == INVALID
+    assert decode._decode(b'\x01' + bytes(make_packet(0xCE, (0, 10, 0, 0)))[1:]) == INVALID
+    assert decode._decode(make_packet(0x55, (0, 0, 0, 0))) == UNKNOWN_TYPE
+    assert scale.weight is None
+
+
+def test_led_response_sets_info_and_resolves():
+    scale, decode = decoder()
+    ack = decode.pending[0x0A] = Resolvable()
+    packet = make_packet(0x0A, (1, 1, 0xFF, 0x03))
+    assert decode._decode(packet) == OK
+    assert (scale.weight_unit, scale.battery_level, scale.firmware_version) == ('oz', 'USB', '1.2')
+    assert ack.result == packet
+
+    decode._decode(make_packet(0x0A, (1, 0, 80, 0x42)))
+    assert (scale.weight_unit, scale.battery_level, scale.firmware_version) == ('g', 80, 'Unknown (42)')
+
+
+def test_tare_response_resolves_its_counter():
+    scale, decode = decoder()
+    first = decode.pending[(0x0F, 1)] = Resolvable()
+    second = decode.pending[(0x0F, 2)] = Resolvable()
+    decode._decode(make_packet(0x0F, (2, 0, 0, 0xFE)))
+    assert first.result is None
+    assert second.result is not None
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Prometheus pages rendered by MetricsExporter."""
+
+from pydecentscale.async_scale import AsyncDecentScale
+from pydecentscale.exporter import FAMILIES, PREFIX, MetricsExporter
+
+ADDRESS = 'FA:KE:00:00:00:01'
+
+
+def series(page):
+    """{name: value} of the series of one scale"""
+    values = {}
+    for line in page.decode().splitlines():
+        if not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            values[name] = value
+    return values
+
+
+def test_counters():
+    scale = AsyncDecentScale(metrics=True)
+    scale.weight = 12.5
+    metrics = scale.metrics
+    metrics.notifications, metrics.weights = 12, 10
+    metrics.disconnects, metrics.reconnects = 3, 2
+    exporter = MetricsExporter(min_interval=0)
+    exporter.add(scale, ADDRESS)
+    page = exporter.render()
+
+    for name, type_, _ in FAMILIES:
+        assert ('# TYPE %s%s %s\n' % (PREFIX, name, type_)).encode() in page
+    values = series(page)
+    label = '{address="%s"}' % ADDRESS
+    assert values[PREFIX + 'weight_grams' + label] == '12.5'
+    assert values[PREFIX + 'notifications_total' + label] == '12'
+    assert values[PREFIX + 'weights_total' + label] == '10'
+    assert values[PREFIX + 'disconnects_total' + label] == '3'
+    assert values[PREFIX + 'reconnects_total' + label] == '2'
+    assert values[PREFIX + 'up' + label] == '0'
+
+
+def test_counters_need_metrics():
+    scale = AsyncDecentScale()
+    exporter = MetricsExporter(min_interval=0)
+    exporter.add(scale, ADDRESS)
+    values = series(exporter.render())
+    assert PREFIX + 'up{address="%s"}' % ADDRESS in values
+    assert not [name for name in values if name.startswith(PREFIX + 'weights_total')]
+    assert not [name for name in values if name.startswith(PREFIX + 'disconnects_total')]
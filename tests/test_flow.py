@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""FlowEstimator against a NumPy least-squares fit of the same window."""
+
+import random
+
+import pytest
+
+from pydecentscale.flow import FlowEstimator
+from pydecentscale.stream import WeightSample
+
+np = pytest.importorskip('numpy')
+
+
+def shot(count, device_timer, seed=1):
+    """Noisy 2 g/s samples about 10 per second, with a step every 15 s:
+    (host seconds, scale timer seconds, grams) per sample"""
+    rng = random.Random(seed)
+    host = 1000.0
+    samples = []
+    for i in range(count):
+        host += 0.1 + rng.uniform(-0.02, 0.02)
+        weight = round(0.2 * i + 0.5 * (i // 150) + rng.uniform(-0.2, 0.2), 1)
+        samples.append((host, i / 10 if device_timer else None, weight))
+    return samples
+
+
+def feed(flow, samples):
+    for host, device, weight in samples:
+        device_time = None if device is None else int(round(device * 10))
+        flow.update(WeightSample(int(host * 1e9), weight, int(weight * 10), device_time))
+
+
+@pytest.mark.parametrize('device_timer', [False, True])
+def test_flow_rate_matches_reference_fit(device_timer):
+    # 800 samples span more than REBASE_AFTER, so the sums are rebased
+    samples = shot(800, device_timer)
+    flow = FlowEstimator(window=1.0)
+    feed(flow, samples)
+
+    host, device, weight = (np.array(column, dtype=float) for column in zip(*samples))
+    # The window is in host time; the slope is against the scale timer when
+    # every sample carries one
+    in_window = host >= host[-1] - 1.0
+    x = device if device_timer else host
+    expected = np.polyfit(x[in_window], weight[in_window], 1)[0]
+    assert flow.flow_rate == pytest.approx(expected, rel=1e-6, abs=1e-9)
+
+
+def test_too_few_samples():
+    flow = FlowEstimator()
+    assert flow.flow_rate is None
+    feed(flow, shot(1, False))
+    assert flow.flow_rate is None
+
+
+def test_timer_reset_restarts_window():
+    flow = FlowEstimator(window=5.0)
+    feed(flow, shot(30, True))
+    # reset_time(): the scale timer starts again from zero, weight flat
+    last = shot(30, True)[-1][0]
+    feed(flow, [(last + 0.1 * (i + 1), i / 10, 50.0) for i in range(5)])
+    assert flow.flow_rate == pytest.approx(0.0, abs=1e-9)
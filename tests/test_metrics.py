@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""ScaleMetrics counters and the windowed sample rate."""
+
+import time
+
+import pytest
+
+from pydecentscale import metrics
+from pydecentscale.metrics import OK, XOR_FAILED, ScaleMetrics
+
+WEIGHT = bytes((0x03, 0xCE, 0, 0, 0, 0, 0xCD))
+
+
+def arrive(m, rate, seconds, end_ns):
+    """Weight packets at ``rate`` Hz for ``seconds``, the last at ``end_ns``"""
+    count = int(rate * seconds)
+    for i in range(count):
+        t = end_ns - (count - 1 - i) * int(1e9 / rate)
+        m.notification(OK, WEIGHT, t, t)
+
+
+def test_sample_rate_is_recent():
+    m = ScaleMetrics()
+    now = time.perf_counter_ns()
+    # A minute at 10 Hz, then 2 Hz for longer than the window
+    arrive(m, 10, 60, now - int(10e9))
+    arrive(m, 2, 10, now)
+    assert m.weights == 620
+    assert m.sample_rate == pytest.approx(2.0)
+    assert m.snapshot()['sample_rate'] == m.sample_rate
+
+
+def test_sample_rate_after_packets_stop():
+    m = ScaleMetrics()
+    arrive(m, 10, 2, time.perf_counter_ns() - int((metrics.RATE_WINDOW + 1) * 1e9))
+    assert m.sample_rate is None
+    m.reset()
+    arrive(m, 10, 2, time.perf_counter_ns())
+    assert m.sample_rate == pytest.approx(10.0)
+
+
+def test_counters():
+    m = ScaleMetrics()
+    m.notification(OK, WEIGHT, 0, 1000)
+    m.notification(XOR_FAILED, WEIGHT, 0, 1000)
+    m.notification(OK, bytes((0x03, 0xAA, 1, 1, 0, 0, 0xA9)), 0, 1000)
+    snapshot = m.snapshot()
+    assert snapshot['counters']['notifications'] == 3
+    assert snapshot['counters']['weights'] == 1
+    assert snapshot['counters']['xor_failures'] == 1
+    assert snapshot['sample_rate'] is None
+    assert snapshot['histograms']['decode_us']['count'] == 3
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Session files written by SessionRecorder and read back by SessionReader."""
+
+import itertools
+
+import pytest
+
+from pydecentscale.async_scale import AsyncDecentScale
+from pydecentscale.recorder import (FLAG_WEIGHT, FLAG_XOR_OK, HEADER_SIZE, RECORD_SIZE, SessionReader,
+                                    SessionRecorder)
+from pydecentscale.replay import make_packet
+
+pytest.importorskip('numpy')
+
+WEIGHT = bytes(make_packet(0xCE, (0xFF, 0x38, 0, 0)))        # -20.0 g
+TIMED = bytes(make_packet(0xCA, (0x01, 0x2C, 1, 2, 3, 0, 0)))  # 30.0 g at 1:02.3
+BUTTON = bytes(make_packet(0xAA, (1, 2, 0, 0)))
+UNKNOWN = bytes(make_packet(0x55, (0, 0, 0, 0)))
+CORRUPT = WEIGHT[:-1] + bytes([WEIGHT[-1] ^ 0xFF])
+SHORT = b'\x03\xce'
+PACKETS = [WEIGHT, TIMED, BUTTON, UNKNOWN, CORRUPT, SHORT]
+FLAGS = [FLAG_XOR_OK | FLAG_WEIGHT, FLAG_XOR_OK | FLAG_WEIGHT, FLAG_XOR_OK, FLAG_XOR_OK, 0, 0]
+RAW = [-200, 300, 0, 0, 0, 0]
+
+
+def check(path):
+    with SessionReader(path) as session:
+        assert len(session) == len(PACKETS)
+        assert session.host_ns.tolist() == list(range(100, 100 + len(PACKETS)))
+        assert session.flags.tolist() == FLAGS
+        assert session.raw.tolist() == RAW
+        assert [packet for _, packet in session.iter_packets()] == PACKETS
+        host_ns, grams = session.weights()
+        assert host_ns.tolist() == [100, 101]
+        assert grams.tolist() == [-20.0, 30.0]
+
+
+def test_recorder_round_trip(tmp_path):
+    path = str(tmp_path / 'session.pyds')
+    with SessionRecorder(path) as recorder:
+        for host_ns, packet in enumerate(PACKETS, 100):
+            recorder.record(packet, host_ns)
+    assert recorder.count == len(PACKETS)
+    check(path)
+
+
+def test_scale_records_decoded_packets(tmp_path):
+    path = str(tmp_path / 'session.pyds')
+    scale = AsyncDecentScale()
+    decode = scale.notification_handler
+    decode.clock = itertools.count(100).__next__
+    scale.record(path)
+    for packet in PACKETS:
+        decode(None, packet)
+    scale.stop_recording()
+    check(path)
+
+
+def test_append_drops_partial_record(tmp_path):
+    path = tmp_path / 'session.pyds'
+    with SessionRecorder(str(path)) as recorder:
+        for host_ns, packet in enumerate(PACKETS[:3], 100):
+            recorder.record(packet, host_ns)
+    # A crash in the middle of a record
+    with open(str(path), 'ab') as f:
+        f.write(b'\x00' * (RECORD_SIZE // 2))
+    with SessionRecorder(str(path)) as recorder:
+        for host_ns, packet in enumerate(PACKETS[3:], 103):
+            recorder.record(packet, host_ns)
+    assert path.stat().st_size == HEADER_SIZE + RECORD_SIZE * len(PACKETS)
+    check(str(path))
+
+
+def test_not_a_session_file(tmp_path):
+    path = tmp_path / 'other.bin'
+    path.write_bytes(b'not a session file at all')
+    with pytest.raises(ValueError):
+        SessionReader(str(path))
+    with pytest.raises(ValueError):
+        SessionRecorder(str(path))
+
+
+def test_empty_session(tmp_path):
+    path = str(tmp_path / 'session.pyds')
+    SessionRecorder(path).close()
+    with SessionReader(path) as session:
+        assert len(session) == 0
+        assert list(session.iter_packets()) == []
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Replays of recorded sessions through AsyncDecentScale, as a regression
+test without Bluetooth hardware."""
+
+import asyncio
+import time
+
+import pytest
+
+from pydecentscale.recorder import SessionReader, SessionRecorder
+from pydecentscale.replay import ReplayClient, main, make_packet, replay, scale_response
+from pydecentscale.async_scale import AsyncDecentScale
+
+
+def shot(seconds=4.0, flow=2.0, rate=10):
+    """(host_ns, packet) pairs of a shot at ``flow`` g/s, timer included"""
+    packets = []
+    for i in range(int(seconds * rate)):
+        raw = int(round(i / rate * flow * 10))
+        packet = make_packet(0xCE, (raw >> 8, raw & 0xFF, 0, i // 10, i % 10, 0, 0))
+        packets.append((5 * 10 ** 9 + i * 10 ** 9 // rate, bytes(packet)))
+    return packets
+
+
+def test_replay_as_fast_as_possible():
+    async def main():
+        packets = shot()
+        scale, count = await replay(packets)
+        assert count == len(packets)
+        assert scale.weight == 7.8
+        # Stamped with the recorded times, not the time of the replay
+        assert scale.sample.host_ns == packets[-1][0]
+        assert scale.flow_rate == pytest.approx(2.0)
+        await scale.disconnect()
+    asyncio.run(main())
+
+
+def test_replay_in_real_time_multiples():
+    async def main():
+        packets = shot(seconds=1.0)
+        started = time.perf_counter()
+        scale, count = await replay(packets, speed=10)
+        elapsed = time.perf_counter() - started
+        assert count == len(packets)
+        # 0.9 s of recorded time at 10x
+        assert 0.08 <= elapsed < 0.5
+        await scale.disconnect()
+    asyncio.run(main())
+
+
+def test_commands_during_replay():
+    async def main():
+        scale = AsyncDecentScale(client_factory=ReplayClient.factory(shot()), fix_dropped_command=False)
+        await scale.connect('replay')
+        play = asyncio.ensure_future(scale.client.play(speed=None))
+        assert await scale.tare() is True
+        await play
+        assert scale.client.writes[-1][1] == 0x0F
+        await scale.disconnect()
+    asyncio.run(main())
+
+
+def test_scale_response():
+    tare = scale_response(bytes((0x03, 0x0F, 0x07, 0, 0, 0, 0x0B)))
+    assert tare[1:3] == b'\x0f\x07'
+    led = scale_response(bytes((0x03, 0x0A, 0x01, 0x01, 0x01, 0, 0x08)), firmware=0xFE, battery=55)
+    assert led[1] == 0x0A and led[4] == 55 and led[5] == 0xFE
+    assert scale_response(bytes((0x03, 0x0B, 0x03, 0, 0, 0, 0x0B))) is None
+
+
+def test_recorded_session_replays_identically(tmp_path):
+    pytest.importorskip('numpy')
+
+    async def main():
+        path = str(tmp_path / 'shot.pyds')
+        scale = AsyncDecentScale(client_factory=ReplayClient.factory(shot()))
+        await scale.connect('replay')
+        scale.record(path)
+        await scale.client.play(speed=None)
+        scale.stop_recording()
+        recorded = (scale.weight, scale.flow_rate)
+        await scale.disconnect()
+
+        with SessionReader(path) as session:
+            replayed, count = await replay(session.iter_packets())
+        assert count == len(shot())
+        assert (replayed.weight, replayed.flow_rate) == recorded
+        await replayed.disconnect()
+    asyncio.run(main())
+
+
+def test_main(tmp_path, capsys):
+    pytest.importorskip('numpy')
+    path = str(tmp_path / 'shot.pyds')
+    with SessionRecorder(path) as recorder:
+        for host_ns, packet in shot():
+            recorder.record(packet, host_ns)
+    main([path])
+    out = capsys.readouterr().out
+    assert 'Replayed 40 packets' in out
+    assert 'Final weight: 7.8 g' in out
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""WeightStream overflow policies and consumers."""
+
+import asyncio
+import threading
+
+import pytest
+
+from pydecentscale.async_scale import AsyncDecentScale
+from pydecentscale.replay import make_packet
+from pydecentscale.stream import BLOCK, DROP_NEWEST, DROP_OLDEST, WeightSample, WeightStream
+
+
+def sample(i):
+    return WeightSample(i, i / 10, i, None)
+
+
+def weights(samples):
+    return [s.raw for s in samples]
+
+
+def test_drop_oldest():
+    stream = WeightStream(3, DROP_OLDEST)
+    assert all(stream.put(sample(i)) for i in range(5))
+    assert stream.dropped == 2
+    assert weights(stream.drain()) == [2, 3, 4]
+
+
+def test_drop_newest():
+    stream = WeightStream(3, DROP_NEWEST)
+    assert [stream.put(sample(i)) for i in range(5)] == [True, True, True, False, False]
+    assert stream.dropped == 2
+    assert weights(stream.drain()) == [0, 1, 2]
+
+
+def test_block_times_out():
+    stream = WeightStream(2, BLOCK, block_timeout=0.01)
+    stream.put(sample(0))
+    stream.put(sample(1))
+    assert not stream.put(sample(2))
+    assert stream.dropped == 1
+    assert weights(stream.drain()) == [0, 1]
+
+
+def test_block_waits_for_consumer():
+    stream = WeightStream(2, BLOCK, block_timeout=5.0)
+    received = []
+
+    def consume():
+        for s in stream:
+            received.append(s.raw)
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    for i in range(50):
+        assert stream.put(sample(i))
+    stream.close()
+    consumer.join(5.0)
+    assert received == list(range(50))
+    assert stream.dropped == 0
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        WeightStream(0)
+    with pytest.raises(ValueError):
+        WeightStream(4, 'drop_everything')
+
+
+def test_closed_stream():
+    closed = []
+    stream = WeightStream(4, on_close=closed.append)
+    stream.put(sample(0))
+    stream.close()
+    stream.close()
+    assert closed == [stream]
+    assert not stream.put(sample(1))
+    # Buffered samples can still be read
+    assert weights(stream) == [0]
+    assert stream.get(timeout=0) is None
+
+
+def test_scale_weights_async():
+    async def main():
+        scale = AsyncDecentScale()
+        received = []
+        async with scale.weights(capacity=8) as stream:
+            for i in range(3):
+                scale.notification_handler(None, make_packet(0xCE, (0, i, 0, 0)))
+            async for s in stream:
+                received.append(s.raw)
+                if len(received) == 3:
+                    break
+        assert received == [0, 1, 2]
+        assert stream.put not in scale.notification_handler.listeners
+    asyncio.run(main())
+
+
+def test_scale_weights_refuses_block():
+    with pytest.raises(ValueError):
+        AsyncDecentScale().weights(overflow=BLOCK)
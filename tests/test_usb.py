@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""FrameParser on USB byte streams: resynchronization, reads split at every
+position and text-protocol lines."""
+
+import pytest
+
+from pydecentscale.replay import make_packet
+from pydecentscale.transport import weight_packet
+from pydecentscale.usb import MAX_LINE, FrameParser, UsbTransport
+
+
+def weight_packets(count, ten_byte=False):
+    packets = []
+    for i in range(count):
+        raw = (i * 7) & 0xFFFF
+        if ten_byte:
+            packets.append(bytes(make_packet(0xCE, (raw >> 8, raw & 0xFF, 0, i // 10 % 60, i % 10, 0, 0))))
+        else:
+            packets.append(bytes(make_packet(0xCE, (raw >> 8, raw & 0xFF, 0, 0))))
+    return packets
+
+
+def feed(parser, stream, size):
+    frames = []
+    for i in range(0, len(stream), size):
+        frames.extend(parser.feed(memoryview(stream)[i:i + size]))
+    return [bytes(frame) for frame in frames]
+
+
+@pytest.mark.parametrize('ten_byte', [False, True])
+def test_resyncs_after_noise(ten_byte):
+    packets = weight_packets(50, ten_byte)
+    corrupt = bytearray(packets[20])
+    corrupt[-1] ^= 0xFF
+    stream = b'\x03\x01\x02\x00' + b''.join(packets[:20]) + bytes(corrupt) + b'\x00\x03' + b''.join(packets[20:])
+
+    parser = FrameParser()
+    assert [bytes(frame) for frame in parser.feed(stream)] == packets
+    assert parser.frames == len(packets)
+    assert parser.skipped == 4 + len(corrupt) + 2
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 10, 32, 4096])
+def test_split_reads(size):
+    packets = weight_packets(40) + weight_packets(40, ten_byte=True) + [bytes(make_packet(0x0F, (1, 0, 0, 0xFE)))]
+    stream = b''.join(packets)
+    assert feed(FrameParser(), stream, size) == packets
+
+
+def test_other_packets_are_seven_bytes():
+    led = bytes(make_packet(0x0A, (1, 0, 100, 3)))
+    weights = weight_packets(3, ten_byte=True)
+    stream = weights[0] + led + weights[1] + weights[2]
+    assert [bytes(frame) for frame in FrameParser().feed(stream)] == [weights[0], led, weights[1], weights[2]]
+
+
+def test_reset():
+    parser = FrameParser()
+    packet = weight_packets(2)[1]
+    parser.feed(packet[:4])
+    parser.reset()
+    # A 7-byte weight packet is only told from a 10-byte one by what follows
+    assert parser.feed(packet) == []
+    assert parser.feed(packet) == [packet, packet]
+
+
+def weight_lines(count):
+    return [b'Weight: %.1f\r\n' % (i / 10) for i in range(count)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 10, 32, 4096])
+def test_text_lines(size):
+    lines = weight_lines(60) + [b'Tare\r\n'] + weight_lines(3)
+    parser = FrameParser()
+    frames = feed(parser, b''.join(lines), size)
+    assert frames == [weight_packet(i / 10) for i in range(60)] + [weight_packet(i / 10) for i in range(3)]
+    assert parser.protocol == 'text'
+    assert parser.binary_frames == 0
+    assert parser.skipped == len(b'Tare\r\n')
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 10, 32, 4096])
+def test_text_and_binary(size):
+    packets = weight_packets(40) + weight_packets(40, ten_byte=True)
+    lines = weight_lines(40)
+    stream = b''.join(packets[:40]) + b''.join(lines) + b''.join(packets[40:]) + b''.join(lines[:5])
+    expected = packets[:40] + [weight_packet(i / 10) for i in range(40)] + packets[40:] + \
+        [weight_packet(i / 10) for i in range(5)]
+
+    parser = FrameParser()
+    assert feed(parser, stream, size) == expected
+    assert parser.binary_frames == 80
+    assert parser.skipped == 0
+
+
+def test_bad_text_lines_skipped():
+    parser = FrameParser()
+    stream = b'Weight: 1e400\nWeight: abc\n' + b'x' * (MAX_LINE + 1) + b'\nWeight: 2.0\n'
+    assert feed(parser, stream, 32) == [weight_packet(2.0)]
+    assert parser.skipped == len(stream) - len(b'Weight: 2.0\n')
+
+
+def test_acknowledges_once_binary_seen():
+    transport = UsbTransport()
+    assert not transport.acknowledges
+    transport.parser.feed(b''.join(weight_lines(3)))
+    assert not transport.acknowledges
+    transport.parser.feed(b''.join(weight_packets(3)))
+    assert transport.acknowledges
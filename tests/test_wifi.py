@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) 2021 Luca Pinello
+# Released under GPLv3
+
+"""Snapshot parsing of the WiFi link: the hand-rolled extractor agrees with
+json.loads on every message, as str and as bytes."""
+
+import pytest
+
+from pydecentscale.wifi import _json_grams, extract_grams, snapshot_uri
+
+MESSAGES = [
+    ('{"grams": 12.3}', 12.3),
+    ('{"grams":-0.5,"ms":1200}', -0.5),
+    ('{ "grams" : 7 , "ms": 3 }', 7.0),
+    ('{"ms": 3, "grams": 18.0}', 18.0),
+    # "grams" as a value, not the key
+    ('{"unit":"grams","weight":5}', None),
+    ('{"unit": "grams", "grams": 3.5}', 3.5),
+    ('{"grams": 1e400}', None),
+    ('{"grams": "heavy"}', None),
+    ('{"grams": null}', None),
+    ('{"weight": 5}', None),
+    ('not json', None),
+]
+
+
+@pytest.mark.parametrize('message, grams', MESSAGES)
+@pytest.mark.parametrize('as_bytes', [False, True])
+def test_extract_grams(message, grams, as_bytes):
+    if as_bytes:
+        message = message.encode()
+    assert extract_grams(message) == grams
+    assert _json_grams(message) == grams
+
+
+def test_snapshot_uri():
+    assert snapshot_uri('ws://hds.local') == 'ws://hds.local/snapshot'
+    assert snapshot_uri('ws://hds.local:8080/other') == 'ws://hds.local:8080/other'